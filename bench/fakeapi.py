@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A local stand-in for the parts of the twitter API clitter talks to,
+serving a synthetic timeline of `total` statuses (ids 1 to `total`, one
+a minute) posted by `users` users:
+
+    statuses/friends_timeline.json   since_id, max_id, count, page
+    statuses/user_timeline.json      id (screen name) and the above
+    account/rate_limit_status.json
+
+Responses are gzipped when asked to and carry X-RateLimit-* headers.
+Status texts and the choice of author are pseudo-random but depend only
+on the status id, so a server and a cache built with the same
+parameters agree. With `skew` above 1 a few users post most statuses.
+"""
+
+import os
+import sys
+import gzip
+import time
+import random
+import urlparse
+import threading
+import cStringIO
+import SocketServer
+import BaseHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from clitter.twitter import jsonlib, dates
+
+WORDS = ("the of and to in is you that it he was for on are as with his they at be this have from "
+         "or one had by word but not what all were we when your can said there use an each which she "
+         "do how their if will up other about out many then them these so some her would make like "
+         "him into time has look two more write go see number no way could people my than first "
+         "water been call who oil its now find long down day did get come made may part").split()
+
+EPOCH = 1219842525  # Wed Aug 27 13:08:45 +0000 2008
+MAX_COUNT = 200
+
+
+class Timeline(object):
+    def __init__(self, total=1000, users=50, skew=1.0, text_words=15):
+        self.total = total
+        self.users = users
+        self.skew = skew
+        self.text_words = text_words
+        self.encoded = {}
+        self.by_user = None
+        self.lock = threading.Lock()
+
+    def user(self, index):
+        return {'id': index + 1,
+                'screen_name': 'user%d' % index,
+                'name': 'User Number %d' % index,
+                'location': 'Somewhere',
+                'description': 'A synthetic user for benchmarks',
+                'profile_image_url': 'http://example.com/%d.png' % index,
+                'url': None,
+                'protected': False,
+                'followers_count': index * 7}
+
+    def author(self, id):
+        return int(self.users * random.Random(-id).random() ** self.skew)
+
+    def status(self, id):
+        rand = random.Random(id)
+        return {'id': id,
+                'created_at': dates.format_created_at(EPOCH + id * 60),
+                'text': ' '.join(rand.choice(WORDS) for i in xrange(self.text_words)),
+                'source': 'web',
+                'truncated': False,
+                'in_reply_to_status_id': None,
+                'in_reply_to_user_id': None,
+                'favorited': False,
+                'user': self.user(self.author(id))}
+
+    def encode(self, id):
+        data = self.encoded.get(id)
+        if data is None:
+            data = self.encoded[id] = jsonlib.dumps(self.status(id))
+        return data
+
+    def user_ids(self, screen_name):
+        """
+        Returns the ids of the statuses of `screen_name`, newest first.
+        """
+        self.lock.acquire()
+        try:
+            if self.by_user is None:
+                self.by_user = {}
+                for id in xrange(self.total, 0, -1):
+                    self.by_user.setdefault('user%d' % self.author(id), []).append(id)
+        finally:
+            self.lock.release()
+        return self.by_user.get(screen_name, [])
+
+    def page(self, ids, since_id=None, max_id=None, count=20, page=1):
+        """
+        Returns the JSON array of the statuses among `ids` (newest first)
+        the query asks for.
+        """
+        count = min(count, MAX_COUNT)
+        ids = [id for id in ids if (since_id is None or id > since_id) and (max_id is None or id <= max_id)]
+        ids = ids[(page - 1) * count:page * count]
+        return '[' + ','.join(self.encode(id) for id in ids) + ']'
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        path, _, query = self.path.partition('?')
+        params = dict(urlparse.parse_qsl(query))
+        def number(name, default=None):
+            if name in params:
+                return int(params[name])
+            return default
+        timeline = server.timeline
+        server.count_request()
+        if path.endswith('/statuses/friends_timeline.json'):
+            body = timeline.page(xrange(timeline.total, 0, -1), number('since_id'), number('max_id'),
+                                 number('count', 20), number('page', 1))
+        elif path.endswith('/statuses/user_timeline.json'):
+            body = timeline.page(timeline.user_ids(params.get('id')), number('since_id'), number('max_id'),
+                                 number('count', 20), number('page', 1))
+        elif path.endswith('/account/rate_limit_status.json'):
+            body = jsonlib.dumps({'hourly_limit': server.hourly_limit,
+                                  'remaining_hits': server.remaining(),
+                                  'reset_time_in_seconds': server.reset_time,
+                                  'reset_time': time.strftime('%a %b %d %H:%M:%S +0000 %Y',
+                                                              time.gmtime(server.reset_time))})
+        else:
+            self.send_error(404)
+            return
+        headers = {'Content-Type': 'application/json; charset=utf-8',
+                   'X-RateLimit-Limit': str(server.hourly_limit),
+                   'X-RateLimit-Remaining': str(server.remaining()),
+                   'X-RateLimit-Reset': str(server.reset_time)}
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = cStringIO.StringIO()
+            f = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6)
+            f.write(body)
+            f.close()
+            body = buf.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+        headers['Content-Length'] = str(len(body))
+        self.send_response(200)
+        for name, value in headers.iteritems():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeTwitter(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves `timeline` on 127.0.0.1 at a free port until shutdown().
+    """
+    daemon_threads = True
+
+    def __init__(self, timeline, hourly_limit=100000):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.timeline = timeline
+        self.hourly_limit = hourly_limit
+        self.reset_time = int(time.time()) + 3600
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def root(self):
+        return 'http://127.0.0.1:%d/' % self.server_port
+
+    def count_request(self):
+        self.lock.acquire()
+        self.requests += 1
+        self.lock.release()
+
+    def remaining(self):
+        return max(0, self.hourly_limit - self.requests)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser(usage="%prog [--statuses N] [--users N] [--skew X]")
+    parser.add_option('--statuses', type="int", default=1000)
+    parser.add_option('--users', type="int", default=50)
+    parser.add_option('--skew', type="float", default=1.0)
+    options, args = parser.parse_args()
+    server = FakeTwitter(Timeline(options.statuses, options.users, options.skew))
+    print "Serving %d statuses at %s (set twitter.api_root to it)" % (options.statuses, server.root)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Times clitter commands end to end against fakeapi.FakeTwitter and
+writes the results as JSON, to compare them across commits:
+
+    python bench/run.py --cache-sizes 0,1000,10000 --new 200 -o before.json
+
+For every cache size a cache holding that many statuses of the friends
+timeline is built once; every run starts from a fresh copy of it in a
+scratch HOME, with the fake server holding `new` statuses more. Each
+scenario runs clitter in this process (a fresh Clitter, connection pool
+emptied) with its output going to /dev/null, so a fetch pays for HTTP,
+decoding, merging into the cache, rendering and writing the cache. The
+startup scenario runs `bin/clitter --help` in a child process instead.
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import platform
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from fakeapi import FakeTwitter, Timeline
+from clitter.clitter import Clitter
+from clitter.cache import StatusStore
+from clitter.twitter import Status, http
+
+CONFIG = """[twitter]
+username = bench
+password = bench
+api_root = %(root)s
+
+[network]
+page_size = 200
+
+[ui]
+use_pager = false
+"""
+
+# name: (clitter arguments, whether the server has new statuses)
+SCENARIOS = [
+    ('fetch_friends', ['-f'], True),
+    ('fetch_many', ['-m', 'user0', 'user1', 'user2'], True),
+    ('render_cached', ['-f'], False),
+    ('query', ['--query', 'friends', '--author', 'user1'], False),
+    ('search', ['-s', 'water'], False),
+    ('export_jsonl', ['--export', 'jsonl'], False),
+    ]
+
+
+def build_cache(directory, timeline, size):
+    """
+    Returns the path of a cache in `directory` holding the `size` oldest
+    statuses of `timeline` as the friends timeline.
+    """
+    path = os.path.join(directory, 'cache-%d.db' % size)
+    store = StatusStore(path)
+    batch = []
+    for id in xrange(1, size + 1):
+        batch.append(Status.from_json(timeline.status(id)))
+        if len(batch) == 1000:
+            store.add('friends_timeline', batch)
+            batch = []
+    store.add('friends_timeline', batch)
+    store.compact()
+    store.close()
+    return path
+
+
+def run_clitter(home, args):
+    """
+    Runs clitter with `args` in this process with `home` as HOME and
+    returns how long it took.
+    """
+    saved = os.environ.get('HOME'), sys.argv, sys.stdout
+    devnull = open(os.devnull, 'w')
+    os.environ['HOME'] = home
+    sys.argv = ['clitter', '--no-daemon'] + args
+    sys.stdout = devnull
+    http.pool.close()
+    try:
+        start = time.time()
+        Clitter().main()
+        return time.time() - start
+    finally:
+        os.environ['HOME'], sys.argv, sys.stdout = saved
+        devnull.close()
+
+
+def run_scenario(scratch, template, root, args):
+    home = tempfile.mkdtemp(dir=scratch)
+    try:
+        f = open(os.path.join(home, '.clitter'), 'w')
+        f.write(CONFIG % {'root': root})
+        f.close()
+        shutil.copy(template, os.path.join(home, '.clitter.db'))
+        return run_clitter(home, args)
+    finally:
+        shutil.rmtree(home)
+
+
+def time_startup(repeat):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT
+    runs = []
+    for i in xrange(repeat):
+        start = time.time()
+        subprocess.check_call([sys.executable, os.path.join(ROOT, 'bin', 'clitter'), '--help'],
+                              stdout=open(os.devnull, 'w'), env=env)
+        runs.append(time.time() - start)
+    return runs
+
+
+def summary(name, runs, **parameters):
+    ordered = sorted(runs)
+    result = dict(parameters)
+    result.update(scenario=name,
+                  runs=runs,
+                  min=ordered[0],
+                  median=ordered[len(ordered) // 2],
+                  mean=sum(runs) / len(runs))
+    return result
+
+
+def commit():
+    try:
+        return subprocess.Popen(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stdout=subprocess.PIPE,
+                                stderr=open(os.devnull, 'w')).communicate()[0].strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--cache-sizes', default="0,1000,10000",
+                      help="Comma separated numbers of cached statuses to run at (default: %default)")
+    parser.add_option('--new', type="int", default=200,
+                      help="Statuses the server has beyond the cached ones (default: %default)")
+    parser.add_option('--users', type="int", default=50,
+                      help="Number of users posting (default: %default)")
+    parser.add_option('--skew', type="float", default=1.0,
+                      help="Above 1, a few users post most statuses (default: %default)")
+    parser.add_option('--repeat', type="int", default=5,
+                      help="Runs per scenario (default: %default)")
+    parser.add_option('--scenarios', default=",".join(['startup'] + [s[0] for s in SCENARIOS]),
+                      help="Comma separated scenarios to run (default: %default)")
+    parser.add_option('-o', '--output',
+                      help="Write the results to OUTPUT instead of stdout")
+    options, args = parser.parse_args()
+    sizes = [int(size) for size in options.cache_sizes.split(",")]
+    wanted = options.scenarios.split(",")
+
+    results = []
+    if 'startup' in wanted:
+        print >>sys.stderr, "startup"
+        results.append(summary('startup', time_startup(options.repeat)))
+    scratch = tempfile.mkdtemp(prefix='clitter-bench-')
+    try:
+        for size in sizes:
+            timeline = Timeline(size + options.new, options.users, options.skew)
+            template = build_cache(scratch, timeline, size)
+            for name, args, new in SCENARIOS:
+                if name not in wanted:
+                    continue
+                print >>sys.stderr, "%s at %d cached" % (name, size)
+                served = Timeline(size + options.new if new else size, options.users, options.skew)
+                served.encoded = timeline.encoded
+                server = FakeTwitter(served).start()
+                try:
+                    runs = [run_scenario(scratch, template, server.root, args)
+                            for i in xrange(options.repeat)]
+                finally:
+                    server.shutdown()
+                    server.server_close()
+                results.append(summary(name, runs, cache_size=size,
+                                       new_statuses=options.new if new else 0,
+                                       requests_per_run=server.requests // options.repeat))
+    finally:
+        shutil.rmtree(scratch)
+
+    report = {'commit': commit(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': int(time.time()),
+              'parameters': {'cache_sizes': sizes,
+                             'new': options.new,
+                             'users': options.users,
+                             'skew': options.skew,
+                             'repeat': options.repeat},
+              'results': results}
+    output = sys.stdout
+    if options.output:
+        output = open(options.output, 'w')
+    json.dump(report, output, indent=2, sort_keys=True)
+    output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
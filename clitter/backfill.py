@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import workers
+from twitter import RateLimitExceeded
+
+
+def fill_gap(fetch, since_id, max_id, count, concurrency=4, max_pages=10):
+    """
+    Fetches the statuses newer than `since_id` and not newer than `max_id`
+    a poll missed, page by page with
+    `fetch(since_id=..., max_id=..., count=..., page=...)`, `concurrency`
+    pages at a time, until a page comes back short or `max_pages` pages
+    were fetched. max_id stays pinned so statuses posted meanwhile don't
+    shift the pages. Running out of rate limit ends the backfill with
+    whatever was fetched by then.
+
+    Returns a tuple (statuses, rest): the statuses, newest first and
+    without duplicates, and the max_id of the part of the gap still to
+    be fetched, or None if the gap is closed.
+    """
+    missing = {}
+    # the oldest status of the pages fetched so far without one missing
+    oldest = None
+    broken = False
+    page = 1
+    while page <= max_pages:
+        batch = range(page, min(page + concurrency, max_pages + 1))
+        def fetch_page(page):
+            return fetch(since_id=since_id, max_id=max_id, count=count, page=page)
+        done = False
+        for ok, result in workers.map_concurrently(fetch_page, batch, concurrency):
+            if not ok:
+                if isinstance(result[1], RateLimitExceeded):
+                    done = broken = True
+                    continue
+                raise result[0], result[1], result[2]
+            for status in result:
+                missing[status.id] = status
+            if not broken and result:
+                oldest = min(status.id for status in result)
+            if len(result) < count:
+                if not broken:
+                    return sorted(missing.itervalues(), key=lambda status: status.id, reverse=True), None
+                done = True
+        if done:
+            break
+        page += len(batch)
+    if oldest is not None:
+        max_id = oldest - 1
+    return sorted(missing.itervalues(), key=lambda status: status.id, reverse=True), max_id
@@ -26,27 +26,603 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import shelve
+import os
+import sys
+import time
+import sqlite3
+import threading
+import whichdb
+import cPickle as pickle
 
+from twitter.models import Status, User
+from twitter.metrics import timed
+import search
 
-class ObjectsPersistance(object):
-    def __init__(self, filename):
+
+class Retention(object):
+    """
+    Limits on what a cached timeline keeps: the number of statuses, their
+    age in seconds and the total size of their records in bytes. A limit
+    of 0 disables the corresponding check. The oldest statuses go first.
+    """
+    def __init__(self, max_entries=0, max_age=0, max_bytes=0):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+
+
+def synchronized(method):
+    def wrapper(self, *args, **kwargs):
+        self.lock.acquire()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.lock.release()
+    return wrapper
+
+
+class StatusStore(object):
+    """
+    Keeps cached timelines of models.Status in an SQLite database. Every
+    status and user is stored once; a timeline is a list of status ids
+    whose size triggers keep count of, so that the Retention `retention`
+    returns for a timeline name is cheap to enforce. Statuses are indexed
+    by word for search() and by author and date for query().
+
+    It is also the store the rest of clitter keeps state in between runs
+    (rate limits, HTTP validators, the circuit breaker, unfinished
+    backfills): get(name) returns what set(name, value) stored, or ''.
+    A list of statuses set under a name becomes that timeline. A shelve
+    left at `filename` by older versions is imported on first open.
+
+    Commits go to a write-ahead log that compact() merges back; use the
+    'delete' `journal_mode` where SQLite lacks shared memory (some NFS).
+    Calls are serialized, so a store can be shared between threads.
+    """
+    SCHEMA_VERSION = 7
+    SCHEMA = """
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY,
+        screen_name TEXT COLLATE NOCASE,
+        data BLOB NOT NULL
+    );
+    CREATE INDEX users_screen_name ON users (screen_name);
+    CREATE TABLE statuses (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        created_at INTEGER NOT NULL,
+        data BLOB NOT NULL
+    );
+    CREATE INDEX statuses_user_id ON statuses (user_id);
+    CREATE INDEX statuses_created_at ON statuses (created_at);
+    CREATE TABLE timeline_entries (
+        timeline TEXT NOT NULL,
+        status_id INTEGER NOT NULL,
+        created_at INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        PRIMARY KEY (timeline, status_id)
+    );
+    CREATE INDEX timeline_entries_status_id ON timeline_entries (status_id);
+    CREATE INDEX timeline_entries_created_at ON timeline_entries (timeline, created_at);
+    CREATE TABLE timelines (
+        timeline TEXT PRIMARY KEY,
+        entries INTEGER NOT NULL DEFAULT 0,
+        bytes INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TRIGGER timeline_entries_insert AFTER INSERT ON timeline_entries BEGIN
+        INSERT OR IGNORE INTO timelines (timeline) VALUES (new.timeline);
+        UPDATE timelines SET entries = entries + 1, bytes = bytes + new.size
+            WHERE timeline = new.timeline;
+    END;
+    CREATE TRIGGER timeline_entries_delete AFTER DELETE ON timeline_entries BEGIN
+        UPDATE timelines SET entries = entries - 1, bytes = bytes - old.size
+            WHERE timeline = old.timeline;
+        DELETE FROM statuses WHERE id = old.status_id
+            AND NOT EXISTS (SELECT 1 FROM timeline_entries WHERE status_id = old.status_id);
+    END;
+    CREATE TRIGGER statuses_delete AFTER DELETE ON statuses BEGIN
+        DELETE FROM users WHERE id = old.user_id
+            AND NOT EXISTS (SELECT 1 FROM statuses WHERE user_id = old.user_id);
+    END;
+    CREATE TABLE objects (
+        name TEXT PRIMARY KEY,
+        data BLOB NOT NULL
+    );
+    CREATE TABLE status_terms (
+        token TEXT NOT NULL,
+        status_id INTEGER NOT NULL,
+        positions TEXT NOT NULL,
+        PRIMARY KEY (token, status_id)
+    );
+    CREATE INDEX status_terms_status_id ON status_terms (status_id);
+    CREATE TABLE user_terms (
+        token TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        positions TEXT NOT NULL,
+        PRIMARY KEY (token, user_id)
+    );
+    CREATE INDEX user_terms_user_id ON user_terms (user_id);
+    CREATE TRIGGER statuses_delete_terms AFTER DELETE ON statuses BEGIN
+        DELETE FROM status_terms WHERE status_id = old.id;
+    END;
+    CREATE TRIGGER users_delete_terms AFTER DELETE ON users BEGIN
+        DELETE FROM user_terms WHERE user_id = old.id;
+    END;
+    """
+
+    def __init__(self, filename, retention=None, journal_mode='wal'):
         self.filename = filename
-        self.shelve = None
+        self.retention = retention
+        self.journal_mode = journal_mode
+        self.db = None
+        self.compaction = None
+        self.writer = None
+        self.write_error = None
+        self.lock = threading.RLock()
 
+    @synchronized
     def open(self):
-        self.shelve = shelve.open(self.filename, writeback=True)
+        if self.db is None:
+            self.__setup()
+        return self.db
 
-    def get(self, name):
-        self.open()
-        if self.shelve.has_key(name):
-            retval = self.shelve[name]
-        else:
-            retval = ''
-        self.shelve.close()
+    @timed('cache.open')
+    def __setup(self):
+        legacy = None
+        if whichdb.whichdb(self.filename) and not self.__is_sqlite():
+            legacy = self.__read_shelve()
+        self.db = self.__connect()
+        self.__create_schema()
+        if legacy:
+            for name, data in legacy.iteritems():
+                self.set(name, data)
+
+    def __connect(self):
+        db = sqlite3.connect(self.filename, timeout=30, check_same_thread=False)
+        db.text_factory = str
+        db.execute("PRAGMA journal_mode = %s" % self.journal_mode)
+        if self.journal_mode.lower() == 'wal':
+            # the log is merged by compact(), not in the middle of a write
+            db.execute("PRAGMA wal_autocheckpoint = 0")
+            db.execute("PRAGMA synchronous = NORMAL")
+        return db
+
+    @timed('cache.compact')
+    def compact(self):
+        """
+        Merges the write-ahead log into the database file and truncates it.
+        """
+        if self.journal_mode.lower() != 'wal':
+            return
+        db = sqlite3.connect(self.filename, timeout=30)
+        try:
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            db.close()
+
+    @synchronized
+    def size(self):
+        """
+        Returns the number of cached statuses and the bytes the cache
+        takes on disk, write-ahead log included.
+        """
+        statuses = self.open().execute("SELECT count(*) FROM statuses").fetchone()[0]
+        size = 0
+        for path in (self.filename, self.filename + '-wal'):
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return statuses, size
+
+    def start_compaction(self):
+        if self.compaction is None or not self.compaction.isAlive():
+            self.compaction = threading.Thread(target=self.compact)
+            self.compaction.start()
+
+    def add_behind(self, timelines):
+        """
+        Like add_many(), but returns right away and writes on a background
+        thread, then starts a compaction; wait() and close() wait for it.
+        The statuses go into the cache in a single transaction, so a run
+        killed halfway through leaves it as it was before.
+        """
+        self.wait()
+        self.writer = threading.Thread(target=self.__write_behind, args=(timelines,))
+        self.writer.start()
+
+    def __write_behind(self, timelines):
+        try:
+            self.add_many(timelines)
+            self.start_compaction()
+        except:
+            self.write_error = sys.exc_info()
+
+    def wait(self):
+        """
+        Waits for the write started by add_behind(), raising what it raised.
+        """
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+        if self.write_error is not None:
+            error, self.write_error = self.write_error, None
+            raise error[0], error[1], error[2]
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            if self.compaction is not None:
+                self.compaction.join()
+                self.compaction = None
+            self.__close()
+
+    @synchronized
+    def __close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __create_schema(self):
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version == self.SCHEMA_VERSION:
+            return
+        # it's a cache: rather than migrating an older layout, start over
+        tables = self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        for (table,) in tables:
+            self.db.execute("DROP TABLE %s" % table)
+        self.db.executescript(self.SCHEMA)
+        self.db.execute("PRAGMA user_version = %d" % self.SCHEMA_VERSION)
+        self.db.commit()
+
+    def __is_sqlite(self):
+        try:
+            f = open(self.filename, 'rb')
+        except IOError:
+            return False
+        header = f.read(16)
+        f.close()
+        return header == 'SQLite format 3\0'
+
+    def __read_shelve(self):
+        import shelve
+        legacy = shelve.open(self.filename, 'r')
+        try:
+            retval = dict(legacy)
+        finally:
+            legacy.close()
+        # bsddb and gdbm keep the shelve right at the filename
+        if os.path.exists(self.filename):
+            os.rename(self.filename, self.filename + '.old')
         return retval
 
+    def __dumps(self, data):
+        return sqlite3.Binary(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+
+    def __loads(self, data):
+        return pickle.loads(str(data))
+
+    def __is_timeline(self, data):
+        return isinstance(data, list) and data and all(isinstance(status, (Status, dict)) for status in data)
+
+    def __store_user(self, user):
+        db = self.db
+        data = self.__dumps(user.__getstate__())
+        cursor = db.execute("UPDATE users SET data = ?, screen_name = ? WHERE id = ? AND data != ?",
+                            (data, user.screen_name, user.id, data))
+        if not cursor.rowcount:
+            cursor = db.execute("INSERT OR IGNORE INTO users (id, screen_name, data) VALUES (?, ?, ?)",
+                                (user.id, user.screen_name, data))
+        if cursor.rowcount:
+            self.__index_user(user)
+
+    def __index_user(self, user):
+        self.db.execute("DELETE FROM user_terms WHERE user_id = ?", (user.id,))
+        self.db.executemany("INSERT INTO user_terms (token, user_id, positions) VALUES (?, ?, ?)",
+                            [(token, user.id, positions) for token, positions
+                             in search.postings(user.screen_name, user.name).iteritems()])
+
+    def __index_status(self, status):
+        self.db.executemany("INSERT INTO status_terms (token, status_id, positions) VALUES (?, ?, ?)",
+                            [(token, status.id, positions) for token, positions
+                             in search.postings(status.text).iteritems()])
+
+    def __store_status(self, status):
+        """
+        Returns the size of the stored record.
+        """
+        user_id = None
+        if status.user is not None:
+            user_id = status.user.id
+            self.__store_user(status.user)
+        data = self.__dumps((status.id, status.created_at, status.text, None, status.extra_blob))
+        cursor = self.db.execute("INSERT OR IGNORE INTO statuses (id, user_id, created_at, data) VALUES (?, ?, ?, ?)",
+                                 (status.id, user_id, status.created_at, data))
+        if cursor.rowcount:
+            self.__index_status(status)
+        return len(data)
+
+    def __add(self, timeline, statuses):
+        db = self.db
+        added = 0
+        for status in statuses:
+            size = self.__store_status(status)
+            cursor = db.execute("INSERT OR IGNORE INTO timeline_entries (timeline, status_id, created_at, size) VALUES (?, ?, ?, ?)",
+                                (timeline, status.id, status.created_at, size))
+            added += cursor.rowcount
+        if added and self.retention is not None:
+            self.evict(timeline, self.retention(timeline))
+        return added
+
+    @timed('cache.merge')
+    @synchronized
+    def add(self, timeline, statuses):
+        """
+        Stores `statuses` under `timeline`, skipping the ones that are
+        already there, and evicts what the retention policy of the
+        timeline no longer allows. Returns the number of statuses
+        actually added.
+        """
+        db = self.open()
+        added = self.__add(timeline, statuses)
+        db.commit()
+        return added
+
+    @timed('cache.merge')
+    @synchronized
+    def add_many(self, timelines):
+        """
+        Like add() for each of the (timeline, statuses) pairs in
+        `timelines`, all in a single transaction.
+        """
+        db = self.open()
+        added = 0
+        for timeline, statuses in timelines:
+            added += self.__add(timeline, statuses)
+        db.commit()
+        return added
+
+    @synchronized
+    def evict(self, timeline, retention):
+        """
+        Deletes the oldest statuses of `timeline` that exceed `retention`.
+        """
+        if retention is None:
+            return
+        db = self.open()
+        if retention.max_age:
+            db.execute("DELETE FROM timeline_entries WHERE timeline = ? AND created_at < ?",
+                       (timeline, int(time.time() - retention.max_age)))
+        row = db.execute("SELECT entries, bytes FROM timelines WHERE timeline = ?", (timeline,)).fetchone()
+        if row is None:
+            return
+        entries, size = row
+        if retention.max_entries and entries > retention.max_entries:
+            oldest_kept = db.execute("SELECT status_id FROM timeline_entries WHERE timeline = ? ORDER BY status_id DESC LIMIT 1 OFFSET ?",
+                                     (timeline, retention.max_entries - 1)).fetchone()[0]
+            db.execute("DELETE FROM timeline_entries WHERE timeline = ? AND status_id < ?", (timeline, oldest_kept))
+            size = db.execute("SELECT bytes FROM timelines WHERE timeline = ?", (timeline,)).fetchone()[0]
+        if retention.max_bytes and size > retention.max_bytes:
+            excess = size - retention.max_bytes
+            newest_evicted = None
+            for status_id, length in db.execute("SELECT status_id, size FROM timeline_entries WHERE timeline = ? ORDER BY status_id",
+                                                (timeline,)):
+                newest_evicted = status_id
+                excess -= length
+                if excess <= 0:
+                    break
+            db.execute("DELETE FROM timeline_entries WHERE timeline = ? AND status_id <= ?", (timeline, newest_evicted))
+
+    @synchronized
+    def newest_id(self, timeline):
+        db = self.open()
+        return db.execute("SELECT max(status_id) FROM timeline_entries WHERE timeline = ?", (timeline,)).fetchone()[0]
+
+    @timed('cache.read')
+    @synchronized
+    def range(self, timeline, since_id=None, max_id=None, limit=None):
+        """
+        Returns statuses of `timeline` newer than `since_id` and not newer
+        than `max_id`, newest first, at most `limit` of them. Statuses by
+        the same user share one User.
+        """
+        db = self.open()
+        query = """SELECT s.data, s.user_id, u.data FROM timeline_entries t
+                   JOIN statuses s ON s.id = t.status_id
+                   LEFT JOIN users u ON u.id = s.user_id
+                   WHERE t.timeline = ?"""
+        args = [timeline]
+        if since_id is not None:
+            query += " AND t.status_id > ?"
+            args.append(since_id)
+        if max_id is not None:
+            query += " AND t.status_id <= ?"
+            args.append(max_id)
+        query += " ORDER BY t.status_id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(limit)
+        return self.__statuses(db.execute(query, args))
+
+    def __statuses(self, rows, users=None):
+        """
+        Rebuilds statuses from (data, user_id, user data) rows, with one
+        User per user.
+        """
+        if users is None:
+            users = {}
+        retval = []
+        for data, user_id, user_data in rows:
+            status = Status(*self.__loads(data))
+            if user_id is not None:
+                if user_id not in users:
+                    users[user_id] = User(*self.__loads(user_data))
+                status.user = users[user_id]
+            retval.append(status)
+        return retval
+
+    @timed('cache.read')
+    @synchronized
+    def query(self, timeline=None, author=None, since=None, until=None, since_id=None, max_id=None,
+              limit=None):
+        """
+        Returns cached statuses, newest first, at most `limit` of them:
+        those of `timeline` (all of them if None), by the user with the
+        screen name `author`, created between the epoch seconds `since`
+        and `until` and with ids above `since_id` and up to `max_id`,
+        leaving out the conditions that are None. The author and date
+        conditions are answered by indexes on users.screen_name,
+        statuses.user_id and statuses.created_at.
+        """
+        db = self.open()
+        query = """SELECT s.data, s.user_id, u.data FROM statuses s
+                   LEFT JOIN users u ON u.id = s.user_id"""
+        conditions = []
+        args = []
+        if timeline is not None:
+            query += " JOIN timeline_entries t ON t.status_id = s.id"
+            conditions.append("t.timeline = ?")
+            args.append(timeline)
+        if author is not None:
+            conditions.append("s.user_id IN (SELECT id FROM users WHERE screen_name = ?)")
+            args.append(author)
+        if since is not None:
+            conditions.append("s.created_at >= ?")
+            args.append(since)
+        if until is not None:
+            conditions.append("s.created_at <= ?")
+            args.append(until)
+        if since_id is not None:
+            conditions.append("s.id > ?")
+            args.append(since_id)
+        if max_id is not None:
+            conditions.append("s.id <= ?")
+            args.append(max_id)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY s.id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(limit)
+        return self.__statuses(db.execute(query, args))
+
+    def iter_query(self, timeline=None, author=None, since=None, until=None, since_id=None, max_id=None,
+                   limit=None, batch_size=500):
+        """
+        Like query(), but yields the statuses one at a time, reading them
+        `batch_size` at a time, so that memory use doesn't grow with the
+        number of statuses that match. Other threads may use the store
+        in between batches.
+        """
+        while limit is None or limit > 0:
+            size = batch_size
+            if limit is not None:
+                size = min(size, limit)
+                limit -= size
+            batch = self.query(timeline, author, since, until, since_id, max_id, size)
+            for status in batch:
+                yield status
+            if len(batch) < size:
+                return
+            max_id = batch[-1].id - 1
+
+    @timed('cache.read')
+    @synchronized
+    def search(self, query, limit=None):
+        """
+        Returns the cached statuses matching every term of `query` (see
+        search.parse_query) in their text or author names, newest first,
+        at most `limit` of them.
+        """
+        db = self.open()
+        matches = None
+        for kind, words in search.parse_query(query):
+            found = self.__match(kind, words)
+            if matches is None:
+                matches = found
+            else:
+                matches &= found
+            if not matches:
+                return []
+        ids = sorted(matches or (), reverse=True)[:limit]
+        users = {}
+        retval = []
+        # stay below the limit on the number of bound parameters
+        for start in xrange(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = db.execute("""SELECT s.data, s.user_id, u.data FROM statuses s
+                                 LEFT JOIN users u ON u.id = s.user_id
+                                 WHERE s.id IN (%s) ORDER BY s.id DESC""" % ", ".join("?" * len(chunk)),
+                              chunk)
+            retval.extend(self.__statuses(rows, users))
+        return retval
+
+    def __match(self, kind, words):
+        """
+        Returns the ids of the statuses whose text or author matches the
+        search term (`kind`, `words`).
+        """
+        db = self.db
+        if kind == search.PHRASE_TERM:
+            found = self.__phrase("status_terms", "status_id", words)
+            users = self.__phrase("user_terms", "user_id", words)
+            for user_id in users:
+                found.update(id for id, in db.execute("SELECT id FROM statuses WHERE user_id = ?", (user_id,)))
+            return found
+        if kind == search.PREFIX_TERM:
+            condition, word = "token GLOB ?", words[0] + "*"
+        else:
+            condition, word = "token = ?", words[0]
+        rows = db.execute("""SELECT status_id FROM status_terms WHERE %s
+                             UNION SELECT s.id FROM user_terms u JOIN statuses s ON s.user_id = u.user_id
+                             WHERE u.%s""" % (condition, condition), (word, word))
+        return set(id for id, in rows)
+
+    def __phrase(self, table, column, words):
+        """
+        Returns the ids in `column` of `table` where `words` occur one
+        right after the other.
+        """
+        starts = None
+        for offset, word in enumerate(words):
+            found = {}
+            for key, positions in self.db.execute("SELECT %s, positions FROM %s WHERE token = ?" % (column, table),
+                                                  (word,)):
+                if starts is not None and key not in starts:
+                    continue
+                shifted = set(int(position) - offset for position in positions.split())
+                if starts is not None:
+                    shifted &= starts[key]
+                if shifted:
+                    found[key] = shifted
+            starts = found
+            if not starts:
+                break
+        return set(starts)
+
+    @timed('cache.get')
+    @synchronized
+    def get(self, name):
+        db = self.open()
+        retval = self.range(name)
+        if retval:
+            return retval
+        row = db.execute("SELECT data FROM objects WHERE name = ?", (name,)).fetchone()
+        if row is not None:
+            return self.__loads(row[0])
+        return ''
+
+    @timed('cache.set')
+    @synchronized
     def set(self, name, data):
-        self.open()
-        self.shelve[name] = data
-        self.shelve.close()
+        db = self.open()
+        db.execute("DELETE FROM timeline_entries WHERE timeline = ?", (name,))
+        db.execute("DELETE FROM timelines WHERE timeline = ?", (name,))
+        db.execute("DELETE FROM objects WHERE name = ?", (name,))
+        if self.__is_timeline(data):
+            # lists of decoded dicts come from shelves of older versions
+            users = {}
+            self.add(name, [status if isinstance(status, Status) else Status.from_json(status, users=users)
+                            for status in data])
+        else:
+            db.execute("INSERT INTO objects (name, data) VALUES (?, ?)", (name, self.__dumps(data)))
+            db.commit()
@@ -26,18 +26,23 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import sys
+if '--startup-profile' in sys.argv:
+    import importprofile
+    importprofile.install()
+
 import os
-from pprint import pprint
-from datetime import datetime
-import logging
+import signal
+from functools import partial
 from optparse import OptionParser
 
 import twitter
+from twitter.metrics import timed
 from config import Config
-from cache import ObjectsPersistance
 import terminal_controller
-
-logging.basicConfig(format="%(asctime)s %(levelname)s: %(message)s")
+import workers
+import backfill
+import output
 
 
 class Clitter(object):
@@ -48,56 +53,67 @@ class Clitter(object):
         self.dump_http = False
         self.quiet = False
         self.show_ids = False
-        self.shelve = ObjectsPersistance(os.path.expanduser("~/.clitter.db"))
+        self.use_daemon = True
+        self._store = None
         self.config = Config(os.path.expanduser("~/.clitter"))
-
-    def __print(self, text):
-        try:
-            print text.encode('utf-8')
-        except IOError:
-            return
-
-    def _print(self, text):
+        # rate limiters by username
+        self.schedulers = {}
+        self.format_date = None
+        self.output = output.OutputSink(sys.stdout)
+        self.command = None
+        self.timings = False
+        self.metrics_file = None
+
+    def __print(self, text, flush=False):
+        self.output.write_line(text, flush)
+
+    def _print(self, text, flush=False):
         if not self.quiet:
-            self.__print(text)
+            self.__print(text, flush)
 
     def print_data(self, text):
-        self._print(self.term.render(u"${YELLOW}%s${NORMAL}" % text))
+        self._print(self.term.render(u"${YELLOW}%s${NORMAL}", text))
 
     def print_error(self, text):
-        self._print(self.term.render(u"${RED}%s${NORMAL}" % text))
+        self._print(self.term.render(u"${RED}%s${NORMAL}", text), flush=True)
 
     def print_progress(self, text):
-        self._print(self.term.render(u"${GREEN}%s${NORMAL}" % text))
-
-    def print_timeline(self, timeline, print_names=False):
-        # uglinessssss
-        for status in timeline:
-            date = self.process_date(status['created_at'])
+        self._print(self.term.render(u"${GREEN}%s${NORMAL}", text), flush=True)
+
+    @timed('render')
+    def print_timeline(self, timeline, print_names=False, flush=False):
+        """
+        With `flush` set the statuses are shown right away rather than
+        buffered, for new ones arriving from the network.
+        """
+        if print_names:
+            template = u"${YELLOW}%s${NORMAL}: ${CYAN}%s:${NORMAL} %s"
+        else:
+            template = u"${YELLOW}%s${NORMAL}: %s"
+        last = len(timeline) - 1
+        for index, status in enumerate(timeline):
+            date = self.process_date(status.created_at)
             left = date
             if self.show_ids:
-                left = "%s %s" % (status['id'], date)
-            left = self.term.render(u"${YELLOW}%s${NORMAL}: " % left)
-
+                left = "%s %s" % (status.id, date)
             if print_names:
-                right = self.term.render("${CYAN}%s:${NORMAL} %s" % (status['user']['name'], status['text']))
+                line = self.term.render(template, left, status.user.name, status.text)
             else:
-                right = self.term.render(status['text'])
-            self.__print("%s%s" % (left, right))
+                line = self.term.render(template, left, status.text)
+            self.__print(line, flush and index == last)
 
     def print_unexpected_json(self, data):
-        self.__print("${RED}%s:${NORMAL}$" % "Unexpected json reply")
-        pprint(data)
+        from pprint import pformat
+        self.__print(self.term.render(u"${RED}%s:${NORMAL}", "Unexpected json reply"))
+        self.__print(pformat(data))
 
     def print_separator(self, caption):
-        self._print(self.term.render("${YELLOW}====${NORMAL}%s${YELLOW}====${NORMAL}" % caption))
+        self._print(self.term.render(u"${YELLOW}====${NORMAL}%s${YELLOW}====${NORMAL}", caption))
 
-    def process_date(self, date):
-        date = self.parse_date(date)
-        return date.strftime(self.config['twitter.timeline_date_format'])
-
-    def parse_date(self, date):
-        return datetime.strptime(date, "%a %b %d %H:%M:%S +0000 %Y")
+    def process_date(self, seconds):
+        if self.format_date is None:
+            self.format_date = twitter.dates.Formatter(self.config['twitter.timeline_date_format'])
+        return self.format_date(seconds)
 
     def handle_args(self):
         parser = OptionParser(usage="%progname -r|-a|-f", version="0.1")
@@ -114,6 +130,55 @@ class Clitter(object):
         parser.add_option('-f', '--fetch-friends',
                           action='store_true', # dirty workaround?
                           help="Fetch friends timeline")
+        parser.add_option('-m', '--fetch-many',
+                          action='store_true',
+                          help="Fetch friends timeline and timelines of given users concurrently")
+        parser.add_option('--account',
+                          metavar="NAME",
+                          help="Use the account of the [twitter:NAME] section of ~/.clitter")
+        parser.add_option('--all-accounts',
+                          action='store_true',
+                          dest="all_accounts",
+                          help="Fetch the friends timelines of all accounts concurrently (with -f)")
+        parser.add_option('-s', '--search',
+                          metavar="QUERY",
+                          help="Search cached statuses; QUERY is words, \"phrases\" and prefix* terms")
+        parser.add_option('--query',
+                          action='store_true',
+                          help="List cached statuses of the friends timeline, a user's timeline or all of them, filtered by the options below")
+        parser.add_option('--author',
+                          metavar="SCREENNAME",
+                          help="Only statuses by SCREENNAME (with --query and --export)")
+        parser.add_option('--since',
+                          metavar="DATE",
+                          help="Only statuses created from DATE on, as YYYY-MM-DD[ HH:MM[:SS]] UTC (with --query and --export)")
+        parser.add_option('--until',
+                          metavar="DATE",
+                          help="Only statuses created up to DATE (with --query and --export)")
+        parser.add_option('--since-id',
+                          type="int",
+                          dest="since_id",
+                          help="Only statuses with ids above SINCE_ID (with --query and --export)")
+        parser.add_option('--max-id',
+                          type="int",
+                          dest="max_id",
+                          help="Only statuses with ids up to MAX_ID (with --query and --export)")
+        parser.add_option('--limit',
+                          type="int",
+                          help="Print at most LIMIT statuses (with --query, --export and --search)")
+        parser.add_option('--export',
+                          metavar="FORMAT",
+                          help="Write the statuses --query would list to stdout as jsonl or csv")
+        parser.add_option('--fields',
+                          metavar="FIELDS",
+                          help="Comma separated fields to export: id, created_at, timestamp, text, user_id, screen_name, name or a kept extra field (default: id,created_at,screen_name,text)")
+        parser.add_option('--daemon',
+                          action='store_true',
+                          help="Keep polling the friends timeline and serve it to other runs")
+        parser.add_option('--no-daemon',
+                          action='store_true',
+                          dest="no_daemon",
+                          help="Fetch from twitter even if a daemon is running")
         parser.add_option('-d', '--destroy',
                           default=0,
                           type="int",
@@ -131,9 +196,19 @@ class Clitter(object):
                            action='store_true',
                            dest="show_ids",
                            help="Print ids in timeline")
+        parser.add_option('--startup-profile',
+                          action='store_true',
+                          help="Report how long importing each module took")
         parser.add_option('--dump-http',
                           action='store_true',
                           help="Print debug HTTP requests and responses")
+        parser.add_option('--timings',
+                          action='store_true',
+                          help="Print how long each phase of the run took to stderr")
+        parser.add_option('--metrics-file',
+                          dest="metrics_file",
+                          metavar="PATH",
+                          help="Add the timings, traffic and cache size of this run to the Prometheus textfile PATH (default: metrics.textfile)")
         options, args = parser.parse_args()
 
         self.quiet = bool(options.quiet)
@@ -141,26 +216,136 @@ class Clitter(object):
         self.no_cache = bool(options.no_cache)
         self.show_ids = bool(options.show_ids)
         self.dump_http = bool(options.dump_http)
+        self.use_daemon = not options.no_daemon
+        self.timings = bool(options.timings)
+
+        if self.dump_http:
+            import logging
+            logging.basicConfig(format="%(asctime)s %(levelname)s: %(message)s")
+            logging.getLogger('twitter.http').setLevel(logging.DEBUG)
 
-        http_logger = logging.getLogger('twitter.http')
-        http_logger.setLevel(10 if self.dump_http else 0)
+        # the options are valid, now read what the command will need
+        self.config.read()
+        self.output = self.make_output()
+        if options.account is not None:
+            if options.account not in self.config.accounts():
+                self.print_error("No [twitter:%s] section in %s" % (options.account, self.config.filename))
+                return
+            self.config = self.config.profile(options.account)
+
+        self.metrics_file = options.metrics_file or self.config['metrics.textfile']
 
         if options.rate_time_limit:
-            self.command_rate_limit_status()
+            self.run(self.command_rate_limit_status)
         elif options.fetch_user:
-            self.command_fetch_user_timeline(args[0] if args else None)
+            self.run(self.command_fetch_user_timeline, args[0] if args else None)
+        elif options.fetch_friends and options.all_accounts:
+            self.run(self.command_fetch_accounts)
         elif options.fetch_friends:
-            self.command_fetch_friends_timeline()
+            self.run(self.command_fetch_friends_timeline)
+        elif options.fetch_many:
+            self.run(self.command_fetch_many, args)
+        elif options.search:
+            self.run(self.command_search, options.search, options.limit)
+        elif options.query:
+            self.run(self.command_query, args[0] if args else None, options)
+        elif options.export:
+            self.run(self.command_export, options.export, args[0] if args else None, options)
+        elif options.daemon:
+            self.run(self.command_daemon)
         elif options.destroy:
-            self.command_destroy(options.destroy)
+            self.run(self.command_destroy, options.destroy)
         elif options.add_status is not None:
-            self.command_add(options.add_status)
+            self.run(self.command_add, options.add_status)
         else:
             parser.print_help()
 
+    def run(self, command, *args):
+        # names the run in the metrics: command_fetch_many is fetch_many
+        self.command = command.__name__[len('command_'):]
+        command(*args)
+
+    def make_output(self):
+        """
+        Returns a sink for stdout that pages output taller than the
+        terminal if ui.use_pager is set.
+        """
+        lines = None
+        if self.config.get_bool('ui.use_pager') and sys.stdout.isatty():
+            lines = self.terminal_lines
+        return output.OutputSink(sys.stdout, lines)
+
+    def terminal_lines(self):
+        self.term.setup()
+        return self.term.LINES
+
+    def setup_http(self):
+        from twitter import http
+        twitter.set_api_root(self.config['twitter.api_root'])
+        http.pool.max_per_host = int(self.config['network.max_connections_per_host'])
+        http.pool.idle_timeout = float(self.config['network.idle_timeout'])
+        http.pool.connect_timeout = float(self.config['network.connect_timeout'])
+        http.pool.read_timeout = float(self.config['network.read_timeout'])
+        http.retries = int(self.config['network.retries'])
+        http.backoff = float(self.config['network.retry_backoff'])
+        http.breaker = twitter.CircuitBreaker(self.store,
+                                              int(self.config['network.breaker_threshold']),
+                                              float(self.config['network.breaker_cooldown']))
+
+    def retention(self, timeline):
+        """
+        Reads the [cache] limits for `timeline`; options prefixed with the
+        kind of timeline (friends_timeline, user_timeline) take precedence.
+        """
+        from cache import Retention
+        kind = timeline.split(':')[-1].split('/')[0]
+        def option(name):
+            value = self.config['cache.%s.%s' % (kind, name)]
+            if value is None:
+                value = self.config['cache.%s' % name]
+            return value
+        return Retention(int(option('max_entries')),
+                         float(option('max_age_days')) * 24 * 60 * 60,
+                         int(option('max_bytes')))
+
     def main(self):
-        self.config.read()
-        self.handle_args()
+        try:
+            self.handle_args()
+        finally:
+            # the output goes out while a write-behind is still running
+            self.output.close()
+            for scheduler in self.schedulers.itervalues():
+                scheduler.save()
+            if self.schedulers:
+                from twitter import http
+                http.breaker.save()
+            cache_size = None
+            if self._store is not None:
+                if self.metrics_file:
+                    cache_size = self._store.size()
+                self._store.close()
+            self.report_timings(cache_size)
+
+    def report_timings(self, cache_size):
+        if not self.timings and not (self.metrics_file and self.command):
+            return
+        import timings
+        if self.timings:
+            timings.report(sys.stderr)
+        if self.metrics_file and self.command:
+            timings.write_textfile(os.path.expanduser(self.metrics_file), self.command, cache_size)
+
+    @property
+    def store(self):
+        """
+        The status cache, created on first use so that commands which
+        don't need it don't pay for loading sqlite.
+        """
+        if self._store is None:
+            from cache import StatusStore
+            self._store = StatusStore(os.path.expanduser("~/.clitter.db"), self.retention,
+                                      self.config['cache.journal_mode'])
+        return self._store
 
     def handle_api_response(self, api_callable, *args, **kwargs):
         try:
@@ -171,8 +356,48 @@ class Clitter(object):
         else:
             return retval
 
+    def make_api(self, priority=twitter.INTERACTIVE, config=None, max_wait=None):
+        """
+        Returns an API for the account of `config`, a profile of
+        self.config and by default self.config itself. The accounts
+        share the connection pool; each has a rate limiter of its own,
+        which background calls wait for at most `max_wait` seconds
+        (network.rate_max_wait by default).
+        """
+        if config is None:
+            config = self.config
+        keep_extra = self.config.get_bool('cache.keep_extra_fields')
+        if not self.schedulers:
+            self.setup_http()
+        username = config['twitter.username']
+        scheduler = self.schedulers.get(username)
+        if scheduler is None:
+            scheduler = self.schedulers[username] = twitter.RateLimiter(
+                username, self.store,
+                float(self.config['network.rate_reserve']),
+                int(self.config['network.rate_burst']),
+                float(self.config['network.rate_max_wait']))
+        return twitter.APIRequest(username,
+                                  config['twitter.password'],
+                                  self.store,
+                                  keep_extra,
+                                  scheduler,
+                                  priority,
+                                  max_wait)
+
+    def timeline_key(self, timeline, config=None):
+        """
+        Returns the name `timeline` of the account of `config` is cached
+        under: the account of the plain [twitter] section uses the names
+        as they are, profiles prefix them, e.g. work:friends_timeline.
+        """
+        account = (config or self.config).account
+        if account is None:
+            return timeline
+        return "%s:%s" % (account, timeline)
+
     def command_rate_limit_status(self):
-        api = twitter.APIRequest(self.config['twitter.username'], self.config['twitter.password'])
+        api = self.make_api()
         self.print_progress("Retrieving rate limit status...")
         data = self.handle_api_response(api.get_rate_limit_status)
         if data:
@@ -182,7 +407,7 @@ class Clitter(object):
                 self.print_unexpected_json(data)
 
     def command_destroy(self, status_id):
-        api = twitter.APIRequest(self.config['twitter.username'], self.config['twitter.password'])
+        api = self.make_api()
         self.print_progress("Deleting status...")
         data = self.handle_api_response(api.destroy, status_id)
         if data:
@@ -191,67 +416,347 @@ class Clitter(object):
             else:
                 self.print_unexpected_json(data)
 
-    def command_fetch_friends_timeline(self):
-        api = twitter.APIRequest(self.config['twitter.username'], self.config['twitter.password'])
-        self.print_progress("Fetching friends timeline")
-        # pick up last entry
+    def fetch_timeline(self, timeline, fetcher, print_names=False):
+        """
+        Fetches statuses newer than the ones cached as `timeline` with
+        `fetcher(api)(since_id=..., stream=True)`, printing each of them
+        as soon as it arrives, then prints the cached ones and stores the
+        new ones.
+        """
+        separate = self.config['ui.separate_cached_entries']
+        fetch = fetcher(self.make_api())
+        since_id = self.store.newest_id(timeline)
         json = []
-        shelve_key = "friends_timeline"
-        since_id = None
-        prev_timeline = self.shelve.get(shelve_key)
-        if prev_timeline:
-            since_id = prev_timeline[0]['id']
-        json = self.handle_api_response(api.get_friends_timeline, since_id=since_id)
-        if json or prev_timeline:
-            json = json or []
-            prev_timeline = prev_timeline or []
-            if prev_timeline:
-                self.shelve.set(shelve_key, json + prev_timeline)
-            else:
-                self.shelve.set(shelve_key, json)
-
-            if self.config['ui.separate_cached_entries']:
-                self.print_separator("new entries")
-            if json:
-                self.print_timeline(json, print_names=True)
-            else:
+        complete = True
+        statuses = self.handle_api_response(fetch, since_id=since_id, stream=True,
+                                            count=int(self.config['network.page_size']))
+        if statuses is not None:
+            try:
+                for status in statuses:
+                    if not json and separate:
+                        self.print_separator("new entries")
+                    json.append(status)
+                    self.print_timeline([status], print_names, flush=True)
+            except twitter.TwitterTransportError, e:
+                # keep what arrived before the connection failed
+                self.print_error(e)
+                complete = False
+        missing = self.fill_gap(fetcher, timeline, json, since_id, complete=complete)
+        self.print_timeline(missing, print_names, flush=True)
+        json.extend(missing)
+        if json or since_id is not None:
+            if not json:
+                if separate:
+                    self.print_separator("new entries")
                 self.print_error("No updates")
             if not self.no_cache:
-                if self.config['ui.separate_cached_entries']:
+                if separate:
                     self.print_separator("cached entries")
-                self.print_timeline(prev_timeline, print_names=True)
+                if since_id is not None:
+                    self.print_timeline(self.store.range(timeline, max_id=since_id), print_names)
+        self.persist([(timeline, json)])
+
+    def persist(self, timelines):
+        """
+        Stores the new statuses of `timelines`, (timeline, statuses) pairs,
+        in the cache. With cache.write_behind set that happens on a
+        background thread the run only waits for before it exits.
+        """
+        timelines = [(timeline, statuses) for timeline, statuses in timelines if statuses]
+        if not timelines:
+            return
+        if self.config.get_bool('cache.write_behind'):
+            self.store.add_behind(timelines)
+        else:
+            self.store.add_many(timelines)
+            self.store.start_compaction()
+
+    def fill_gap(self, fetcher, timeline, first_page, since_id, config=None, complete=True,
+                 foreground=True):
+        """
+        Returns the statuses of `timeline` newer than `since_id` that didn't
+        fit into `first_page`, and those of the gaps earlier runs left
+        open, fetched at background priority with `fetcher(api)`: at most
+        network.backfill_pages pages and no more pages than the background
+        share of the rate limit allows. With `foreground` set, for a
+        command the user waits for, only the pages the rate limiter lets
+        through right away are fetched. What is still missing then is
+        kept in the cache for the next run or the daemon. `complete` is
+        False if the first page was cut short by an error. The account
+        is the one of `config`, as for make_api().
+        """
+        count = int(self.config['network.page_size'])
+        key = "gaps %s" % timeline
+        gaps = self.store.get(key) or []
+        previous = list(gaps)
+        if since_id is not None and first_page and (len(first_page) >= count or not complete):
+            gaps.insert(0, (since_id, min(status.id for status in first_page) - 1))
+        if not gaps:
+            return []
+        max_pages = int(self.config['network.backfill_pages'])
+        api = self.make_api(twitter.BACKGROUND, config, 0 if foreground else None)
+        available = api.scheduler.available(twitter.BACKGROUND)
+        if available is None:
+            # nothing known about the budget yet, ask for it once
+            self.handle_api_response(api.get_rate_limit_status)
+            available = api.scheduler.available(twitter.BACKGROUND)
+        if available is not None:
+            max_pages = min(max_pages, available)
+        if foreground:
+            max_pages = min(max_pages, api.scheduler.ready())
+        missing = []
+        rest = []
+        for since, max_id in gaps:
+            result = None
+            if max_pages > 0:
+                result = self.handle_api_response(backfill.fill_gap, fetcher(api), since, max_id, count,
+                                                  int(self.config['network.workers']), max_pages)
+            if result is None:
+                # out of pages or failed: try again next time
+                max_pages = 0
+                rest.append((since, max_id))
+                continue
+            statuses, max_id = result
+            missing.extend(statuses)
+            max_pages -= len(statuses) / count + 1
+            if max_id is not None and max_id > since:
+                rest.append((since, max_id))
+        if rest != previous:
+            self.store.set(key, rest)
+        return missing
+
+    def socket_path(self):
+        path = os.path.expanduser(self.config['daemon.socket'])
+        if self.config.account is not None:
+            # a daemon per account: ~/.clitter-work.sock
+            root, ext = os.path.splitext(path)
+            path = "%s-%s%s" % (root, self.config.account, ext)
+        return path
+
+    def read_from_daemon(self, timeline, print_names=False):
+        """
+        Prints `timeline` as served by a running daemon, the statuses it
+        polled since the last read first. Returns False if no daemon is
+        running.
+        """
+        if not self.use_daemon:
+            return False
+        import daemon
+        reply = daemon.read_timeline(self.socket_path(), timeline, self.no_cache)
+        if reply is None:
+            return False
+        statuses, unread = reply
+        separate = self.config['ui.separate_cached_entries']
+        if separate:
+            self.print_separator("new entries")
+        if unread:
+            self.print_timeline(statuses[:unread], print_names)
+        else:
+            self.print_error("No updates")
+        if not self.no_cache and statuses[unread:]:
+            if separate:
+                self.print_separator("cached entries")
+            self.print_timeline(statuses[unread:], print_names)
+        return True
+
+    def poll_timeline(self, timeline, fetcher):
+        """
+        Fetches the statuses of `timeline` newer than the cached ones at
+        background priority and stores them. Returns them, or None if
+        the request failed.
+        """
+        since_id = self.store.newest_id(timeline)
+        api = self.make_api(twitter.BACKGROUND)
+        statuses = self.handle_api_response(fetcher(api),
+                                            since_id=since_id,
+                                            count=int(self.config['network.page_size']))
+        if statuses is None:
+            return None
+        statuses = statuses + self.fill_gap(fetcher, timeline, statuses, since_id, foreground=False)
+        if statuses:
+            self.store.add(timeline, statuses)
+            self.store.start_compaction()
+        api.scheduler.save()
+        return statuses
+
+    def command_daemon(self):
+        """
+        Polls the friends timeline until interrupted, serving it over the
+        daemon.socket Unix socket.
+        """
+        import daemon
+        import logging
+        logging.basicConfig(format="%(asctime)s %(levelname)s: %(message)s")
+        # runs for good, nothing to page
+        self.output = output.OutputSink(sys.stdout)
+        fetchers = {self.timeline_key("friends_timeline"): lambda api: api.get_friends_timeline}
+        def poll(timeline):
+            return self.poll_timeline(timeline, fetchers[timeline])
+        server = daemon.Daemon(self.store, poll, self.socket_path(), fetchers.keys(),
+                               float(self.config['daemon.min_interval']),
+                               float(self.config['daemon.max_interval']))
+        signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+        self.print_progress("Serving timelines on %s" % server.path)
+        try:
+            server.run()
+        except KeyboardInterrupt:
+            pass
+        except RuntimeError, e:
+            self.print_error(e)
+
+    def command_fetch_friends_timeline(self):
+        if self.read_from_daemon(self.timeline_key("friends_timeline"), print_names=True):
+            return
+        self.print_progress("Fetching friends timeline")
+        self.fetch_timeline(self.timeline_key("friends_timeline"), lambda api: api.get_friends_timeline,
+                            print_names=True)
 
     def command_fetch_user_timeline(self, screenname=''):
         if not screenname:
             screenname = self.config['twitter.username']
-        api = twitter.APIRequest(self.config['twitter.username'], self.config['twitter.password'])
         self.print_progress("Fetching statuses for id %s" % screenname)
-        # pick up last entry
-        json = []
-        shelve_key = "user_timeline/%s" % screenname
-        since_id = None
-        prev_timeline = self.shelve.get(shelve_key)
-        if prev_timeline:
-            since_id = prev_timeline[0]['id']
-        json = self.handle_api_response(api.get_user_timeline, screenname, since_id=since_id)
-        if json or prev_timeline:
-            json = json or []
-            prev_timeline = prev_timeline or []
-            if prev_timeline:
-                self.shelve.set(shelve_key, json + prev_timeline)
-            else:
-                self.shelve.set(shelve_key, json)
-
-            if self.config['ui.separate_cached_entries']:
-                self.print_separator("new entries")
-            if json:
-                self.print_timeline(json)
+        self.fetch_timeline(self.timeline_key("user_timeline/%s" % screenname),
+                            lambda api: partial(api.get_user_timeline, screenname))
+
+    def command_fetch_many(self, screennames):
+        """
+        Fetches the friends timeline and the timelines of `screennames` on
+        a pool of network.workers threads, prints them grouped per timeline
+        and stores all new statuses in one transaction. The timelines are
+        asked for interactively; only their backfills are paced.
+        """
+        jobs = [(self.config, self.timeline_key("friends_timeline"), "friends",
+                 lambda api: api.get_friends_timeline, True, twitter.INTERACTIVE)]
+        for screenname in screennames:
+            jobs.append((self.config, self.timeline_key("user_timeline/%s" % screenname), screenname,
+                         lambda api, screenname=screenname: partial(api.get_user_timeline, screenname),
+                         False, twitter.INTERACTIVE))
+        self.print_progress("Fetching %d timelines" % len(jobs))
+        self.fetch_concurrently(jobs)
+
+    def command_fetch_accounts(self):
+        """
+        Fetches the friends timelines of all accounts like
+        command_fetch_many, each with the rate limit of its account.
+        """
+        jobs = []
+        for account in self.config.accounts():
+            config = self.config.profile(account)
+            jobs.append((config, self.timeline_key("friends_timeline", config),
+                         account or config['twitter.username'],
+                         lambda api: api.get_friends_timeline, True, twitter.INTERACTIVE))
+        if not jobs:
+            self.print_error("No accounts in %s" % self.config.filename)
+            return
+        self.print_progress("Fetching %d accounts" % len(jobs))
+        self.fetch_concurrently(jobs)
+
+    def fetch_concurrently(self, jobs):
+        """
+        Fetches the statuses newer than the cached ones for each of `jobs`,
+        tuples (config, timeline, caption, fetcher, print_names, priority),
+        on a pool of network.workers threads; the account of `config`
+        fetches `timeline` with `fetcher(api)` at `priority`. Prints them
+        grouped per timeline and stores all new statuses in one
+        transaction.
+        """
+        # ask for missing credentials here, not from the workers
+        for config, key, caption, fetcher, print_names, priority in jobs:
+            self.make_api(priority, config)
+        since_ids = [self.store.newest_id(job[1]) for job in jobs]
+        def run(item):
+            (config, key, caption, fetcher, print_names, priority), since_id = item
+            fetch = fetcher(self.make_api(priority, config))
+            statuses = fetch(since_id=since_id, count=int(self.config['network.page_size']))
+            return statuses + self.fill_gap(fetcher, key, statuses, since_id, config)
+        results = workers.map_concurrently(run, zip(jobs, since_ids),
+                                           int(self.config['network.workers']))
+        for ok, result in results:
+            if not ok and not isinstance(result[1], twitter.TwitterTransportError):
+                raise result[0], result[1], result[2]
+
+        separate = self.config['ui.separate_cached_entries']
+        for job, since_id, (ok, result) in zip(jobs, since_ids, results):
+            config, key, caption, fetcher, print_names, priority = job
+            self.print_separator(caption)
+            if not ok:
+                self.print_error(result[1])
+            elif result:
+                self.print_timeline(result, print_names)
             else:
                 self.print_error("No updates")
-            if not self.no_cache:
-                if self.config['ui.separate_cached_entries']:
+            if not self.no_cache and since_id is not None:
+                if separate:
                     self.print_separator("cached entries")
-                self.print_timeline(prev_timeline)
+                self.print_timeline(self.store.range(key, max_id=since_id), print_names)
+        self.persist([(job[1], result) for job, (ok, result) in zip(jobs, results) if ok])
+
+    def query_filters(self, timeline, options):
+        """
+        Returns the keyword arguments for StatusStore.query selecting the
+        statuses of `timeline` ("friends", a screen name for a user
+        timeline, or None for all) that pass the filters in `options`.
+        Raises ValueError on a malformed date.
+        """
+        if timeline == "friends":
+            timeline = self.timeline_key("friends_timeline")
+        elif timeline is not None:
+            timeline = self.timeline_key("user_timeline/%s" % timeline)
+        since = until = None
+        if options.since:
+            since = twitter.dates.parse_iso(options.since)
+        if options.until:
+            until = twitter.dates.parse_iso(options.until, end=True)
+        return dict(timeline=timeline, author=options.author, since=since, until=until,
+                    since_id=options.since_id, max_id=options.max_id, limit=options.limit)
+
+    def command_export(self, format, timeline, options):
+        """
+        Writes the statuses selected like for command_query to stdout in
+        `format`, streaming them out of the store.
+        """
+        import export
+        if format not in export.FORMATS:
+            self.print_error("Unknown export format %s, use one of: %s" % (format, ", ".join(sorted(export.FORMATS))))
+            return
+        fields = export.DEFAULT_FIELDS
+        if options.fields:
+            fields = [name.strip() for name in options.fields.split(",") if name.strip()]
+        try:
+            filters = self.query_filters(timeline, options)
+        except ValueError, e:
+            self.print_error(e)
+            return
+        try:
+            export.FORMATS[format](self.store.iter_query(**filters), sys.stdout, fields)
+            sys.stdout.flush()
+        except IOError:
+            # the reader went away, e.g. `clitter --export csv | head`
+            pass
+
+    def command_query(self, timeline, options):
+        """
+        Prints the cached statuses of `timeline` ("friends", a screen name
+        for a user timeline, or None for every cached status) that pass
+        the filters in `options`, without touching the network.
+        """
+        try:
+            filters = self.query_filters(timeline, options)
+        except ValueError, e:
+            self.print_error(e)
+            return
+        statuses = self.store.query(**filters)
+        if statuses:
+            self.print_timeline(statuses, print_names=True)
+        else:
+            self.print_error("Nothing found")
+
+    def command_search(self, query, limit=None):
+        statuses = self.store.search(query, limit)
+        if statuses:
+            self.print_timeline(statuses, print_names=True)
+        else:
+            self.print_error("Nothing found")
 
     def command_add(self, status):
         if not status.strip():
@@ -268,7 +773,7 @@ class Clitter(object):
             os.remove(tmp_path)
             self.command_add(status)
             return
-        api = twitter.APIRequest(self.config['twitter.username'], self.config['twitter.password'])
+        api = self.make_api()
         self.print_progress("Updating status ...")
         json = self.handle_api_response(api.update, status)
         if json:
@@ -26,26 +26,73 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from getpass import getpass
+import copy
 from ConfigParser import RawConfigParser
 
+from twitter.metrics import timed
+
 
 class Config(object):
     def __init__(self, filename):
         self.filename = filename
         self.config = None
+        # the profile twitter.* options are read from, see profile()
+        self.account = None
         self.params_ask = ['twitter.username', 'twitter.password']
         self.defaults = {
             'twitter.timeline_date_format': '%Y.%m.%d %H:%M:%S',
             'twitter.username': '',
             'twitter.password': '',
-            'ui.separate_cached_entries': True
+            'twitter.api_root': 'http://twitter.com/',
+            'ui.separate_cached_entries': True,
+            # page output that doesn't fit on the screen through $PAGER
+            'ui.use_pager': True,
+            'network.max_connections_per_host': 4,
+            'network.idle_timeout': 30,
+            'network.workers': 4,
+            'network.page_size': 20,
+            # how far back to look when more statuses arrived than fit a page
+            'network.backfill_pages': 10,
+            # share of the hourly limit background requests leave alone,
+            # how many of them may go at once and how long they may wait
+            'network.rate_reserve': 0.2,
+            'network.rate_burst': 10,
+            'network.rate_max_wait': 30,
+            # seconds to wait for a connection and for each read
+            'network.connect_timeout': 10,
+            'network.read_timeout': 30,
+            # GETs failing with a network error or a 5xx are retried
+            # after a backoff starting at retry_backoff seconds
+            'network.retries': 3,
+            'network.retry_backoff': 0.5,
+            # after this many failures in a row twitter is left alone for
+            # breaker_cooldown seconds, also by the runs that follow
+            'network.breaker_threshold': 5,
+            'network.breaker_cooldown': 60,
+            # 0 means unlimited; each can be overridden per kind of
+            # timeline, e.g. cache.user_timeline.max_entries
+            'cache.max_entries': 0,
+            'cache.max_age_days': 0,
+            'cache.max_bytes': 0,
+            'cache.journal_mode': 'wal',
+            # print what was fetched first and write it to the cache on a
+            # background thread while the output goes out
+            'cache.write_behind': True,
+            # keep the status and user fields clitter doesn't use
+            'cache.keep_extra_fields': False,
+            'daemon.socket': '~/.clitter.sock',
+            # seconds between polls while there is activity and when idle
+            'daemon.min_interval': 60,
+            'daemon.max_interval': 600,
+            # Prometheus textfile every run adds its metrics to, if set
+            'metrics.textfile': ''
             }
 
     def __open_config(self):
         f = open(self.filename, 'w+')
         return f
 
+    @timed('config.read')
     def read(self):
         self.config = RawConfigParser()
         if not self.config.read([self.filename]):
@@ -59,15 +106,49 @@ class Config(object):
         self.config.write(f)
         f.close()
 
+    def accounts(self):
+        """
+        Returns the names of the account profiles, the [twitter:NAME]
+        sections, preceded by None for the plain [twitter] section if it
+        has a username too.
+        """
+        accounts = sorted(section.split(":", 1)[1] for section in self.config.sections()
+                          if section.startswith("twitter:"))
+        if self.config.has_option('twitter', 'username'):
+            accounts.insert(0, None)
+        return accounts
+
+    def profile(self, account):
+        """
+        Returns a view of this config that reads and writes the twitter.*
+        options of `account` in its [twitter:`account`] section; options
+        other than the credentials missing there come from [twitter].
+        None is the account of the plain [twitter] section.
+        """
+        profile = copy.copy(self)
+        profile.account = account
+        return profile
+
+    def __sections(self, item, section):
+        if section == 'twitter' and self.account is not None:
+            if item in self.params_ask:
+                return ['twitter:%s' % self.account]
+            return ['twitter:%s' % self.account, section]
+        return [section]
+
     def __getitem__(self, item):
-        section, name = item.split(".")
+        section, name = item.split(".", 1)
         if not all([section, name]):
             return None
-        if self.config.has_section(section) and self.config.has_option(section, name):
-            return self.config.get(section, name)
+        for section in self.__sections(item, section):
+            if self.config.has_section(section) and self.config.has_option(section, name):
+                return self.config.get(section, name)
         else:
             if item in self.params_ask:
+                if self.account is not None:
+                    name = "%s of %s" % (name, self.account)
                 if "password" in item:
+                    from getpass import getpass
                     val = getpass("Please enter %s: " % name)
                 else:
                     val = raw_input("Please enter %s: " % name)
@@ -79,10 +160,17 @@ class Config(object):
                 return self.defaults[item]
             return None
 
+    def get_bool(self, item):
+        value = self[item]
+        if isinstance(value, basestring):
+            return value.strip().lower() in ('1', 'yes', 'true', 'on')
+        return bool(value)
+
     def __setitem__(self, item, value):
-        section, name = item.split(".")
+        section, name = item.split(".", 1)
         if not all([section, name]):
             return None
+        section = self.__sections(item, section)[0]
         if not self.config.has_section(section):
             self.config.add_section(section)
         self.config.set(section, name, value)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import socket
+import logging
+import threading
+import SocketServer
+
+from twitter import jsonlib, Status
+
+logger = logging.getLogger('clitter.daemon')
+
+
+def read_timeline(path, timeline, unread_only=False, timeout=5):
+    """
+    Asks the daemon listening on `path` for the cached statuses of
+    `timeline`, or only those nobody asked for yet if `unread_only`.
+    Returns a tuple of the statuses, newest first, and how many of them
+    are unread, or None if no daemon answers.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        sock.sendall("timeline %s %s\n" % (timeline, "new" if unread_only else "all"))
+        reply = sock.makefile('rb')
+        header = reply.readline().split()
+        if len(header) != 3 or header[0] != "ok":
+            return None
+        count, unread = int(header[1]), int(header[2])
+        users = {}
+        statuses = [Status.from_json(jsonlib.loads(reply.readline()), True, users)
+                    for i in xrange(count)]
+        return statuses, unread
+    except (socket.error, ValueError, KeyError):
+        return None
+    finally:
+        sock.close()
+
+
+def is_running(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(5)
+    try:
+        sock.connect(path)
+        sock.sendall("ping\n")
+        return sock.makefile('rb').readline().strip() == "ok"
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        words = self.rfile.readline().split()
+        if words == ["ping"]:
+            self.wfile.write("ok\n")
+        elif len(words) == 3 and words[0] == "timeline" and words[2] in ("new", "all"):
+            statuses, unread = self.server.owner.read(words[1], words[2] == "new")
+            self.wfile.write("ok %d %d\n" % (len(statuses), unread))
+            for status in statuses:
+                self.wfile.write(jsonlib.dumps(status.to_json()) + "\n")
+        else:
+            self.wfile.write("error unknown request\n")
+
+
+class Daemon(object):
+    """
+    Keeps `timelines` of `store` fresh and serves them over a Unix socket
+    at `path`, so that reading a timeline doesn't wait for the network.
+
+    `poll(timeline)` fetches and stores the new statuses of a timeline
+    and returns them, or None if it failed. Timelines are polled every
+    `min_interval` seconds while there are new statuses; every quiet
+    round stretches the interval by half up to `max_interval`, and a
+    failed one, whether it returned None or raised, goes straight to
+    `max_interval`.
+
+    Statuses added since the last read of a timeline are reported as
+    unread by the next one.
+    """
+    def __init__(self, store, poll, path, timelines, min_interval=60, max_interval=600):
+        self.store = store
+        self.poll = poll
+        self.path = path
+        self.timelines = timelines
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.interval = min_interval
+        self.seen = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.server = None
+
+    def read(self, timeline, unread_only):
+        self.lock.acquire()
+        try:
+            seen = self.seen.get(timeline)
+            newest = self.store.newest_id(timeline)
+            self.seen[timeline] = newest
+        finally:
+            self.lock.release()
+        if newest is None:
+            return [], 0
+        if seen is None:
+            seen = newest
+        if unread_only:
+            statuses = self.store.range(timeline, since_id=seen, max_id=newest)
+        else:
+            statuses = self.store.range(timeline, max_id=newest)
+        return statuses, len([status for status in statuses if status.id > seen])
+
+    def listen(self):
+        if os.path.exists(self.path):
+            if is_running(self.path):
+                raise RuntimeError("a daemon is already listening on %s" % self.path)
+            os.unlink(self.path)
+        mask = os.umask(0077)
+        try:
+            self.server = SocketServer.ThreadingUnixStreamServer(self.path, RequestHandler)
+        finally:
+            os.umask(mask)
+        self.server.daemon_threads = True
+        self.server.owner = self
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def poll_all(self):
+        """
+        Polls every timeline once and adapts the interval to the outcome.
+        """
+        active = False
+        failed = False
+        for timeline in self.timelines:
+            try:
+                statuses = self.poll(timeline)
+            except Exception:
+                logger.exception("polling %s failed" % timeline)
+                statuses = None
+            if statuses is None:
+                failed = True
+            elif statuses:
+                active = True
+        if failed:
+            self.interval = self.max_interval
+        elif active:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * 1.5)
+
+    def run(self):
+        for timeline in self.timelines:
+            self.seen[timeline] = self.store.newest_id(timeline) or 0
+        self.listen()
+        try:
+            while not self.stopped.isSet():
+                self.poll_all()
+                self.stopped.wait(self.interval)
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+            os.unlink(self.path)
+
+    def stop(self):
+        self.stopped.set()
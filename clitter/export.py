@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import csv
+from collections import OrderedDict
+
+from twitter import jsonlib, dates
+
+DEFAULT_FIELDS = ('id', 'created_at', 'screen_name', 'text')
+
+# fields every status has; any other name is looked up in the fields
+# kept with cache.keep_extra_fields
+FIELDS = {
+    'id': lambda status: status.id,
+    'created_at': lambda status: dates.format_created_at(status.created_at),
+    'timestamp': lambda status: status.created_at,
+    'text': lambda status: status.text,
+    'user_id': lambda status: status.user and status.user.id,
+    'screen_name': lambda status: status.user and status.user.screen_name,
+    'name': lambda status: status.user and status.user.name,
+    }
+
+
+def field(status, name):
+    if name in FIELDS:
+        return FIELDS[name](status)
+    return status.extra.get(name)
+
+
+def export_jsonl(statuses, stream, fields=DEFAULT_FIELDS):
+    """
+    Writes every status of the iterable `statuses` to `stream` as a JSON
+    object with the given `fields`, one per line, as it comes.
+    """
+    for status in statuses:
+        stream.write(jsonlib.dumps(OrderedDict((name, field(status, name)) for name in fields)))
+        stream.write('\n')
+
+
+def export_csv(statuses, stream, fields=DEFAULT_FIELDS):
+    """
+    Writes a header row with `fields` and then a row for every status of
+    the iterable `statuses` to `stream` as CSV in UTF-8, as it comes.
+    """
+    writer = csv.writer(stream)
+    writer.writerow(fields)
+    for status in statuses:
+        row = []
+        for name in fields:
+            value = field(status, name)
+            if value is None:
+                value = ''
+            elif isinstance(value, unicode):
+                value = value.encode('utf-8')
+            elif not isinstance(value, (str, int, long, float)):
+                value = jsonlib.dumps(value)
+            row.append(value)
+        writer.writerow(row)
+
+
+FORMATS = {'jsonl': export_jsonl, 'csv': export_csv}
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import sys
+import time
+import atexit
+import __builtin__
+
+started = None
+records = []
+
+
+def install(stream=sys.stderr):
+    """
+    Times every import from now on and writes a report to `stream` at
+    exit: for each module loaded, the time spent in it alone and with
+    the modules it imported, in the order they finished loading, nested
+    by who imported them.
+    """
+    global started
+    started = time.time()
+    real_import = __builtin__.__import__
+    children = [0.0]
+    depth = [0]
+
+    def timed_import(name, *args, **kwargs):
+        before = len(sys.modules)
+        children.append(0.0)
+        depth[0] += 1
+        start = time.time()
+        try:
+            return real_import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            depth[0] -= 1
+            nested = children.pop()
+            children[-1] += elapsed
+            if len(sys.modules) > before:
+                records.append((depth[0], name, elapsed - nested, elapsed))
+
+    __builtin__.__import__ = timed_import
+    atexit.register(report, stream)
+
+
+def report(stream=sys.stderr):
+    total = time.time() - started
+    print >>stream, "import time: self [ms] | cumulative [ms] | module"
+    for depth, name, own, cumulative in records:
+        print >>stream, "import time: %9.2f | %15.2f | %s%s" % (own * 1000, cumulative * 1000,
+                                                               "  " * depth, name)
+    imports = sum(cumulative for depth, name, own, cumulative in records if depth == 0)
+    print >>stream, "startup profile: %.2f ms in imports, %.2f ms total" % (imports * 1000,
+                                                                          total * 1000)
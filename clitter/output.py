@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import threading
+
+from twitter.metrics import timed
+
+
+class OutputSink(object):
+    """
+    Collects output lines and writes them to `stream` in blocks of about
+    `buffer_size` bytes instead of one write per line.
+
+    If `lines`, the height of the terminal `stream` is attached to, or a
+    function returning it when the first line is written, is given,
+    lines are held back until it is known whether they fit on
+    the screen: if they do, they go to `stream` when the sink is closed,
+    otherwise everything is piped into `pager` ($PAGER, less by default)
+    from then on. Lines written with `flush` set, such as progress
+    messages, are shown right away and count against the screen.
+
+    A closed pipe (the pager quit, or `clitter | head` had enough) ends
+    the output quietly; the rest of the lines are discarded.
+
+    Writes are serialized, so worker threads can share a sink.
+    """
+    def __init__(self, stream=sys.stdout, lines=None, pager=None, buffer_size=65536):
+        self.stream = stream
+        self.lines = lines
+        self.pager = pager or os.environ.get("PAGER") or "less"
+        self.buffer_size = buffer_size
+        self.pending = []
+        self.size = 0
+        self.count = 0
+        self.target = None
+        self.process = None
+        self.broken = False
+        self.lock = threading.RLock()
+        if lines is None:
+            self.target = stream
+
+    def write_line(self, text, flush=False):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        self.lock.acquire()
+        try:
+            self.__write_line(text + '\n', flush)
+        finally:
+            self.lock.release()
+
+    def __write_line(self, text, flush):
+        if self.broken:
+            return
+        self.pending.append(text)
+        self.size += len(text)
+        if self.target is None and callable(self.lines):
+            self.lines = self.lines()
+            if self.lines is None:
+                self.target = self.stream
+        if self.target is None:
+            self.count += text.count('\n')
+            if self.count > self.lines:
+                self.target = self.__open_pager()
+            elif flush:
+                self.__write(self.stream)
+                return
+            else:
+                return
+        if flush or self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            if self.target is not None and not self.broken:
+                self.__write(self.target)
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            if self.target is None:
+                self.target = self.stream
+            self.flush()
+            if self.process is not None:
+                try:
+                    self.process.stdin.close()
+                except IOError:
+                    pass
+                self.process.wait()
+                self.process = None
+        finally:
+            self.lock.release()
+
+    @timed('output.write')
+    def __write(self, target):
+        data = ''.join(self.pending)
+        self.pending = []
+        self.size = 0
+        try:
+            target.write(data)
+            target.flush()
+        except IOError:
+            self.broken = True
+
+    def __open_pager(self):
+        import subprocess
+        env = dict(os.environ)
+        # keep colors, and let less quit on its own if it all fits anyway
+        env.setdefault("LESS", "FRX")
+        try:
+            self.process = subprocess.Popen(self.pager, shell=True, stdin=subprocess.PIPE, env=env)
+        except OSError:
+            return self.stream
+        return self.process.stdin
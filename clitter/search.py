@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import re
+
+WORD = re.compile(r'\w+', re.UNICODE)
+TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+WORD_TERM = 'word'
+PREFIX_TERM = 'prefix'
+PHRASE_TERM = 'phrase'
+
+
+def tokenize(text):
+    """
+    Returns the lowercased words of `text`.
+    """
+    if not text:
+        return []
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    return WORD.findall(text.lower())
+
+
+def postings(*texts):
+    """
+    Returns a dict mapping every word of `texts` to the space separated
+    positions it occurs at. Positions run on from one text to the next
+    with a gap in between, so that no phrase spans two texts.
+    """
+    retval = {}
+    position = 0
+    for text in texts:
+        for word in tokenize(text):
+            retval.setdefault(word, []).append(str(position))
+            position += 1
+        position += 1
+    return dict((word, ' '.join(positions)) for word, positions in retval.iteritems())
+
+
+def parse_query(query):
+    """
+    Splits a search query into a list of (kind, words) terms: a "quoted
+    phrase" or a word with punctuation inside is a PHRASE_TERM, a word
+    ending with * a PREFIX_TERM matching every word that starts with
+    it, anything else a WORD_TERM.
+    """
+    terms = []
+    for phrase, word in TERM.findall(query):
+        words = tokenize(phrase or word)
+        if not words:
+            continue
+        if len(words) > 1:
+            terms.append((PHRASE_TERM, words))
+        elif word.endswith('*'):
+            terms.append((PREFIX_TERM, words))
+        else:
+            terms.append((WORD_TERM, words))
+    return terms
@@ -41,6 +41,14 @@ class TerminalController:
 
     Finally, if the width and height of the terminal are known, then
     they will be stored in the `COLS` and `LINES` attributes.
+
+    The terminal is only queried on the first call to `render()`, so
+    that creating a `TerminalController` costs nothing; call `setup()`
+    first to read the attributes directly:
+
+        >>> term = TerminalController()
+        >>> term.setup()
+        >>> print 'This is '+term.GREEN+'green'+term.NORMAL
     """
     # Cursor movement:
     BOL = ''             #: Move the cursor to the beginning of the line
@@ -87,12 +95,24 @@ class TerminalController:
 
     def __init__(self, term_stream=sys.stdout):
         """
-        Create a `TerminalController` and initialize its attributes
-        with appropriate values for the current terminal.
-        `term_stream` is the stream that will be used for terminal
-        output; if this stream is not a tty, then the terminal is
-        assumed to be a dumb terminal (i.e., have no capabilities).
+        Create a `TerminalController` for `term_stream`, the stream
+        that will be used for terminal output; if this stream is not a
+        tty, then the terminal is assumed to be a dumb terminal (i.e.,
+        have no capabilities).
+        """
+        self.term_stream = term_stream
+        self.ready = False
+        self._templates = {}
+
+    def setup(self):
+        """
+        Initialize the attributes with appropriate values for the
+        current terminal, unless that was done already.
         """
+        if self.ready: return
+        self.ready = True
+        term_stream = self.term_stream
+
         # Curses isn't available on all platforms
         try: import curses
         except: return
@@ -140,15 +160,39 @@ class TerminalController:
         cap = curses.tigetstr(cap_name) or ''
         return re.sub(r'\$<\d+>[/*]?', '', cap)
 
-    def render(self, template):
+    def render(self, template, *args):
         """
         Replace each $-substitutions in the given template string with
         the corresponding terminal control string (if it's defined) or
-        '' (if it's not).
-        """
-        return re.sub(r'\$\$|\${\w+}', self._render_sub, template)
+        '' (if it's not).  If `args` are given, they are then inserted
+        into the `%s` fields of the template as they are, so that any
+        '${...}' inside them is left alone.
 
-    def _render_sub(self, match):
-        s = match.group()
+        Templates are compiled once and cached by their string.
+        """
+        compiled = self._templates.get(template)
+        if compiled is None:
+            compiled = self._templates[template] = self._compile(template)
+        if args:
+            return compiled[1] % args
+        return compiled[0]
+
+    def _compile(self, template):
+        """
+        Return `template` with its $-substitutions resolved, both as is
+        and as a format string for `%`.
+        """
+        self.setup()
+        parts = re.split(r'(\$\$|\${\w+})', template)
+        literals = parts[0::2]
+        codes = [self._render_sub(code) for code in parts[1::2]]
+        plain = [literals[0]]
+        formatted = [literals[0]]
+        for code, literal in zip(codes, literals[1:]):
+            plain += [code, literal]
+            formatted += [code.replace('%', '%%'), literal]
+        return ''.join(plain), ''.join(formatted)
+
+    def _render_sub(self, s):
         if s == '$$': return s
         else: return getattr(self, s[2:-1])
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import re
+import time
+
+from twitter.metrics import metrics
+
+
+# counters of twitter.metrics and the Prometheus gauges they are written as
+COUNTERS = [
+    ('http.requests', 'clitter_http_requests', "HTTP requests the last run made"),
+    ('http.bytes_in', 'clitter_http_received_bytes', "HTTP response body bytes the last run received"),
+    ('http.bytes_out', 'clitter_http_sent_bytes', "HTTP request bytes the last run sent"),
+    ('http.retries', 'clitter_http_retries', "HTTP requests the last run repeated after a failure"),
+    ('statuses.fetched', 'clitter_statuses_fetched', "Statuses the last run received from twitter"),
+    ]
+
+SAMPLE = re.compile(r'^(\w+)(\{.*\})?\s')
+HEADER = re.compile(r'^# (?:HELP|TYPE) (\w+) ')
+
+
+def phases():
+    """
+    Returns (phase, calls, seconds) of the phases of this run, slowest
+    first, with the time spent outside any phase as 'other'.
+    """
+    wall = metrics.elapsed()
+    result = [(phase, calls, seconds) for phase, (calls, seconds) in metrics.phases.items()]
+    result.sort(key=lambda item: -item[2])
+    accounted = sum([seconds for phase, calls, seconds in result])
+    if wall > accounted:
+        result.append(('other', 0, wall - accounted))
+    return result
+
+
+def report(stream):
+    """
+    Writes a table of the time spent in each phase to `stream`.
+    """
+    wall = metrics.elapsed()
+    stream.write("%-16s %6s %10s %6s\n" % ("phase", "calls", "seconds", "%"))
+    for phase, calls, seconds in phases():
+        stream.write("%-16s %6s %10.4f %5.1f%%\n" % (phase, calls or '', seconds,
+                                                    100.0 * seconds / max(wall, 1e-9)))
+    stream.write("%-16s %6s %10.4f\n" % ("total", "", wall))
+    counters = metrics.counters
+    stream.write("http: %d requests, %d retries, %d bytes received, %d bytes sent; %d statuses fetched\n" % (
+        counters.get('http.requests', 0), counters.get('http.retries', 0), counters.get('http.bytes_in', 0),
+        counters.get('http.bytes_out', 0), counters.get('statuses.fetched', 0)))
+
+
+def samples(command, cache_size=None):
+    """
+    Returns the metrics of this run as {name: (type, help, [(labels, value)])};
+    every sample is labelled with `command`.
+    """
+    labels = 'command="%s"' % command
+    result = {
+        'clitter_phase_seconds': ('gauge', "Seconds the last run spent in each phase", []),
+        'clitter_phase_calls': ('gauge', "Times the last run entered each phase", []),
+        }
+    for phase, calls, seconds in phases():
+        phase_labels = '%s,phase="%s"' % (labels, phase)
+        result['clitter_phase_seconds'][2].append((phase_labels, seconds))
+        if phase != 'other':
+            result['clitter_phase_calls'][2].append((phase_labels, calls))
+    result['clitter_run_seconds'] = ('gauge', "Wall clock seconds of the last run",
+                                     [(labels, metrics.elapsed())])
+    for counter, name, help in COUNTERS:
+        result[name] = ('gauge', help, [(labels, metrics.counters.get(counter, 0))])
+    if cache_size is not None:
+        statuses, size = cache_size
+        result['clitter_cache_statuses'] = ('gauge', "Statuses in the cache", [(labels, statuses)])
+        result['clitter_cache_bytes'] = ('gauge', "Bytes the cache takes on disk", [(labels, size)])
+    result['clitter_last_run_timestamp_seconds'] = ('gauge', "When the last run finished",
+                                                    [(labels, time.time())])
+    return result
+
+
+def write_textfile(path, command, cache_size=None):
+    """
+    Adds the metrics of this run to the Prometheus textfile at `path`
+    (for node_exporter's textfile collector), replacing those of the
+    previous run of `command` and keeping the other commands'.
+
+    The file is rewritten as a whole and renamed into place so the
+    collector never reads half of it; a lock file keeps concurrent runs
+    from losing each other's samples.
+    """
+    import fcntl
+    lock = open(path + '.lock', 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        current = samples(command, cache_size)
+        mine = '{command="%s"' % command
+        headers = {}
+        kept = {}
+        if os.path.exists(path):
+            for line in open(path):
+                match = HEADER.match(line)
+                if match is not None:
+                    headers.setdefault(match.group(1), []).append(line)
+                    continue
+                match = SAMPLE.match(line)
+                if match is None or (match.group(2) or '').startswith(mine):
+                    continue
+                kept.setdefault(match.group(1), []).append(line)
+        names = sorted(set(current.keys()) | set(kept.keys()))
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        f = open(tmp, 'w')
+        try:
+            for name in names:
+                if name in current:
+                    kind, help, values = current[name]
+                    f.write("# HELP %s %s\n# TYPE %s %s\n" % (name, help, name, kind))
+                else:
+                    f.writelines(headers.get(name, []))
+                for line in kept.get(name, []):
+                    f.write(line)
+                if name in current:
+                    for labels, value in current[name][2]:
+                        f.write("%s{%s} %r\n" % (name, labels, float(value)))
+        finally:
+            f.close()
+        os.rename(tmp, path)
+    finally:
+        lock.close()
@@ -25,61 +25,192 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-try:
-    import json
-except ImportError:
-    try:
-        import cjson as json
-    except ImportError:
-        try:
-            import simplejson as json
-        except ImportError:
-            print "Failed to find any of supported json libraries. Tried: json, cjson, simplejson."
-            exit(1)
-import http
+# http and jsonstream pull in httplib, urllib and json; they are
+# imported where a request is made so that startup doesn't pay for them
+import jsonlib
+import dates
 from decorators import login_requied
+from exceptions import TwitterTransportError, RateLimitExceeded, CircuitOpenError
+from models import Status, User
+from metrics import metrics
+from scheduler import RateLimiter, INTERACTIVE, BACKGROUND
+from breaker import CircuitBreaker
 
 twitter_statuses_prefix = 'http://twitter.com/statuses/'
 twitter_account_prefix = 'http://twitter.com/account/'
 
 
-class TwitterTransportError(Exception):
-    def __init__(self, value):
-        self.value = value
+def set_api_root(root):
+    """
+    Points every API request at `root` instead of http://twitter.com/,
+    e.g. at a compatible service or a local stand-in.
+    """
+    global twitter_statuses_prefix, twitter_account_prefix
+    if not root.endswith('/'):
+        root += '/'
+    twitter_statuses_prefix = root + 'statuses/'
+    twitter_account_prefix = root + 'account/'
 
 
 class APIRequest(object):
-    def __init__(self, username='', password=''):
+    def __init__(self, username='', password='', validators=None, keep_extra=False,
+                 scheduler=None, priority=INTERACTIVE, max_wait=None):
+        """
+        Timelines are returned as lists of models.Status, with the fields
+        those don't project kept encoded alongside if `keep_extra` is set.
+
+        `validators`, a store like cache.StatusStore, makes GETs
+        conditional on the ETag and Last-Modified of the previous response
+        to the same URL and answers a 304 with the payload of back then.
+        Every GET but rate_limit_status waits for `scheduler`, a
+        RateLimiter, at `priority`, at most `max_wait` seconds if given.
+        """
         self.username = username
         self.password = password
+        self.validators = validators
+        self.keep_extra = keep_extra
+        self.scheduler = scheduler
+        self.priority = priority
+        self.max_wait = max_wait
 
     def __get_json_or_error(self, data):
         if isinstance(data, tuple):
             raise TwitterTransportError("%s: %s" % (data[0], data[1]))
-        if "loads" in dir(json): # for simplejson
-            return json.loads(data)
-        else:
-            return json.decode(data)
+        metrics.start('json.decode')
+        try:
+            return jsonlib.loads(data)
+        except ValueError, e:
+            raise TwitterTransportError("Malformed reply: %s" % e)
+        finally:
+            metrics.stop()
+
+    def __GET(self, url, data={}, stream=False, project=None, metered=True):
+        """
+        With `stream` set, returns an iterator over the elements of the
+        JSON array in the response, decoded as they arrive. `project`, if
+        given, is applied to each of the elements.
+        """
+        import http
+        if metered and self.scheduler is not None:
+            self.scheduler.acquire(self.priority, self.max_wait)
+        headers = {}
+        key = query = cached = None
+        if self.validators is not None:
+            query = http.http_data(data)
+            # since/since_id/max_id move forward with every poll, keeping them
+            # out of the key leaves one slot per timeline instead of one per poll
+            slot = dict((k, v) for k, v in data.iteritems() if k not in ('since', 'since_id', 'max_id'))
+            key = "%s %s?%s" % (self.username, url, http.http_data(slot))
+            cached = self.validators.get(key)
+            if cached and cached['query'] != query:
+                cached = None
+            if cached:
+                if cached['etag']:
+                    headers['If-None-Match'] = cached['etag']
+                if cached['last_modified']:
+                    headers['If-Modified-Since'] = cached['last_modified']
+        status, reason, response_headers, body = http.open_request(url, self.username, self.password, data, 'GET', headers)
+        if self.scheduler is not None:
+            self.scheduler.update_from_headers(response_headers)
+        if status == 304 and cached:
+            for chunk in body:
+                pass
+            if stream:
+                return iter(cached['payload'])
+            return cached['payload']
+        if not 200 <= status < 300:
+            for chunk in body:
+                pass
+            return self.__get_json_or_error((status, reason))
+        remember = None
+        if self.validators is not None:
+            etag = response_headers.get('etag')
+            last_modified = response_headers.get('last-modified')
+            if etag or last_modified:
+                def remember(payload):
+                    self.validators.set(key, {'query': query,
+                                              'etag': etag,
+                                              'last_modified': last_modified,
+                                              'payload': payload})
+        if stream:
+            return self.__iter_json(body, remember, project)
+        payload = self.__get_json_or_error(''.join(body))
+        if project is not None:
+            if not isinstance(payload, list):
+                raise TwitterTransportError("Malformed reply: expected a JSON array")
+            metrics.start('json.decode')
+            try:
+                payload = [project(item) for item in payload]
+            finally:
+                metrics.stop()
+        if remember is not None:
+            remember(payload)
+        return payload
+
+    def __iter_json(self, body, remember=None, project=None):
+        import jsonstream
+        items = []
+        decoded = jsonstream.iter_array(body, self.__get_json_or_error)
+        while True:
+            # only the decoding, not what the caller does between items
+            metrics.start('json.decode')
+            try:
+                item = decoded.next()
+                if project is not None:
+                    item = project(item)
+            except StopIteration:
+                break
+            except ValueError, e:
+                # cut off or not an array at all
+                raise TwitterTransportError("Malformed reply: %s" % e)
+            finally:
+                metrics.stop()
+            if remember is not None:
+                items.append(item)
+            yield item
+        # read what's left after the closing bracket (trailing whitespace,
+        # the gzip trailer) so that the connection can be reused
+        for chunk in body:
+            pass
+        if remember is not None:
+            remember(items)
+
+    def __statuses(self):
+        """
+        Returns a function projecting decoded statuses onto Status, sharing
+        one User between the statuses of the same user.
+        """
+        users = {}
+        def project(data):
+            metrics.count('statuses.fetched')
+            return Status.from_json(data, self.keep_extra, users)
+        return project
 
     def get_public_timeline(self):
         url = "%s%s" % (twitter_statuses_prefix, "public_timeline.json")
-        got_data = http.GET(url, self.username, self.password)
-        return self.__get_json_or_error(got_data)
+        return self.__GET(url, project=self.__statuses())
 
     @login_requied
-    def get_friends_timeline(self, since=None, since_id=None, count=None, page=None):
+    def get_friends_timeline(self, since=None, since_id=None, count=None, page=None, stream=False, max_id=None):
         """
         Returns the 20 most recent statuses posted by the authenticating user
         and that user's friends. This is the equivalent of /home on the Web.
+        With `stream` set, statuses are yielded as they arrive.
         """
         url = "%s%s" % (twitter_statuses_prefix, "friends_timeline.json")
         data = {}
         if since is not None:
+            import http
             data['since'] = http.http_date(since)
         if since_id is not None:
             data['since_id'] = since_id
-        got_data = http.GET(url, self.username, self.password, data)
-        return self.__get_json_or_error(got_data)
+        if max_id is not None:
+            data['max_id'] = max_id
+        if count is not None:
+            data['count'] = count
+        if page is not None:
+            data['page'] = page
+        return self.__GET(url, data, stream, self.__statuses())
 
     @login_requied
     def update(self, status, in_reply_to_status_id=None):
@@ -88,6 +219,7 @@ class APIRequest(object):
         specified below.  Request must be a POST.
         """
         url = "%s%s" % (twitter_statuses_prefix, "update.json")
+        import http
         got_data = http.POST(url, self.username, self.password, {'status': status})
         return self.__get_json_or_error(got_data)
 
@@ -98,16 +230,18 @@ class APIRequest(object):
         The authenticating user must be the author of the specified status.
         """
         url = "%s%s" % (twitter_statuses_prefix, "destroy/%s.json" % id)
+        import http
         got_data = http.POST(url, self.username, self.password)
         return self.__get_json_or_error(got_data)
 
     @login_requied
-    def get_user_timeline(self, user_id=None, count=None, since=None, since_id=None, page=None):
+    def get_user_timeline(self, user_id=None, count=None, since=None, since_id=None, page=None, stream=False, max_id=None):
         """
         Returns the 20 most recent statuses posted from the authenticating user.
         It's also possible to request another user's timeline via the id
         parameter below. This is the equivalent of the Web /archive page for
         your own user, or the profile page for a third party.
+        With `stream` set, statuses are yielded as they arrive.
         """
         url = "%s%s" % (twitter_statuses_prefix, "user_timeline.json")
         data = {}
@@ -116,11 +250,17 @@ class APIRequest(object):
         else:
             data['id'] = self.username
         if since is not None:
+            import http
             data['since'] = http.http_date(since)
         if since_id is not None:
             data['since_id'] = since_id
-        got_data = http.GET(url, self.username, self.password, data)
-        return self.__get_json_or_error(got_data)
+        if max_id is not None:
+            data['max_id'] = max_id
+        if count is not None:
+            data['count'] = count
+        if page is not None:
+            data['page'] = page
+        return self.__GET(url, data, stream, self.__statuses())
 
     @login_requied
     def get_rate_limit_status(self):
@@ -131,6 +271,10 @@ class APIRequest(object):
         count against the rate limit.
         """
         url = "%s%s" % (twitter_account_prefix, "rate_limit_status.json")
-        got_data = http.GET(url, self.username, self.password)
-        return self.__get_json_or_error(got_data)
+        data = self.__GET(url, metered=False)
+        if self.scheduler is not None and isinstance(data, dict):
+            self.scheduler.update(data.get("hourly_limit"),
+                                  data.get("remaining_hits"),
+                                  data.get("reset_time_in_seconds"))
+        return data
 
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import time
+import threading
+
+from exceptions import CircuitOpenError
+
+
+class CircuitBreaker(object):
+    """
+    Fails requests to a host with CircuitOpenError for `cooldown` seconds
+    after `threshold` failures in a row, then lets one through to probe
+    it. save() keeps the state in `store` for the next run.
+    """
+    key = "circuit breaker"
+
+    def __init__(self, store=None, threshold=5, cooldown=60):
+        self.store = store
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        # host: [failures in a row, down until]
+        self.hosts = {}
+        if store is not None:
+            self.hosts = store.get(self.key) or {}
+
+    def save(self):
+        if self.store is not None:
+            self.lock.acquire()
+            try:
+                hosts = dict((host, state) for host, state in self.hosts.iteritems() if state[0])
+            finally:
+                self.lock.release()
+            self.store.set(self.key, hosts)
+
+    def check(self, host):
+        """
+        Raises CircuitOpenError if requests to `host` should not be made.
+        """
+        self.lock.acquire()
+        try:
+            state = self.hosts.get(host)
+            if state is None or state[0] < self.threshold:
+                return
+            now = time.time()
+            if now < state[1]:
+                raise CircuitOpenError("%s is not responding, next try in %d seconds" %
+                                       (host, state[1] - now + 1))
+            # let this request probe the host, hold the others back
+            state[1] = now + self.cooldown
+        finally:
+            self.lock.release()
+
+    def success(self, host):
+        self.lock.acquire()
+        try:
+            self.hosts.pop(host, None)
+        finally:
+            self.lock.release()
+
+    def failure(self, host):
+        self.lock.acquire()
+        try:
+            state = self.hosts.setdefault(host, [0, 0])
+            state[0] += 1
+            if state[0] >= self.threshold:
+                state[1] = time.time() + self.cooldown
+        finally:
+            self.lock.release()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import time
+import calendar
+
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTH_NUMBERS = dict((name, number) for number, name in enumerate(MONTHS))
+
+# epoch seconds of midnight by "Mar 27 2007"
+day_starts = {}
+
+
+def parse_created_at(text):
+    """
+    Returns the epoch seconds of a timestamp in the fixed layout of the
+    created_at fields, "Tue Mar 27 22:55:48 +0000 2007". Raises
+    ValueError on anything else.
+    """
+    if len(text) != 30 or text[3] != ' ' or text[13] != ':' or text[16] != ':' \
+            or text[19] != ' ' or text[25] != ' ' or text[20] not in '+-':
+        raise ValueError("Bad created_at timestamp: %r" % text)
+    day = text[4:10] + text[25:30]
+    start = day_starts.get(day)
+    if start is None:
+        start = day_starts[day] = day_start(text)
+    seconds = start + int(text[11:13]) * 3600 + int(text[14:16]) * 60 + int(text[17:19])
+    if text[21:25] != '0000':
+        offset = int(text[21:23]) * 3600 + int(text[23:25]) * 60
+        if text[20] == '-':
+            offset = -offset
+        seconds -= offset
+    return seconds
+
+
+def day_start(text):
+    try:
+        month = MONTH_NUMBERS[text[4:7]] + 1
+    except KeyError:
+        raise ValueError("Bad created_at timestamp: %r" % text)
+    year = int(text[26:30])
+    day = int(text[8:10])
+    if not 1 <= day <= calendar.monthrange(year, month)[1]:
+        raise ValueError("Bad created_at timestamp: %r" % text)
+    return calendar.timegm((year, month, day, 0, 0, 0))
+
+
+def format_created_at(seconds):
+    """
+    Formats epoch seconds in the layout of the created_at fields.
+    """
+    t = time.gmtime(seconds)
+    return "%s %s %02d %02d:%02d:%02d +0000 %d" % (DAYS[t.tm_wday], MONTHS[t.tm_mon - 1], t.tm_mday,
+                                                   t.tm_hour, t.tm_min, t.tm_sec, t.tm_year)
+
+
+def format_http_date(seconds):
+    """
+    Formats epoch seconds as an HTTP date, "Tue, 27 Mar 2007 22:55:48 GMT".
+    """
+    t = time.gmtime(seconds)
+    return "%s, %02d %s %d %02d:%02d:%02d GMT" % (DAYS[t.tm_wday], t.tm_mday, MONTHS[t.tm_mon - 1],
+                                                  t.tm_year, t.tm_hour, t.tm_min, t.tm_sec)
+
+
+class Formatter(object):
+    """
+    Formats epoch seconds in UTC with a strftime `format`, remembering
+    the last `size` results; statuses shown again, or shared between
+    timelines, aren't formatted twice.
+    """
+    def __init__(self, format, size=4096):
+        self.format = format
+        self.size = size
+        self.cache = {}
+
+    def __call__(self, seconds):
+        retval = self.cache.get(seconds)
+        if retval is None:
+            if len(self.cache) >= self.size:
+                self.cache.clear()
+            retval = self.cache[seconds] = time.strftime(self.format, time.gmtime(seconds))
+        return retval
+
+
+def parse_iso(text, end=False):
+    """
+    Returns the epoch seconds of a UTC "YYYY-MM-DD", "YYYY-MM-DD HH:MM"
+    or "YYYY-MM-DD HH:MM:SS". With `end` set, the last second of the day
+    or minute given is returned instead of the first one. Raises
+    ValueError on anything else.
+    """
+    text = text.strip()
+    for layout, length in (("%Y-%m-%d %H:%M:%S", 1), ("%Y-%m-%d %H:%M", 60), ("%Y-%m-%d", 86400)):
+        try:
+            seconds = calendar.timegm(time.strptime(text, layout))
+        except ValueError:
+            continue
+        if end:
+            seconds += length - 1
+        return seconds
+    raise ValueError("Bad date %r, expected YYYY-MM-DD[ HH:MM[:SS]]" % text)
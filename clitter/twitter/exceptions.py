@@ -32,3 +32,20 @@ class NotAuthorizedError(Exception):
 
     def __str__(self):
         return self.value
+
+
+class TwitterTransportError(Exception):
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return self.value
+
+
+class RateLimitExceeded(TwitterTransportError):
+    def __str__(self):
+        return self.value
+
+
+class CircuitOpenError(TwitterTransportError):
+    pass
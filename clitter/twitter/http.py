@@ -26,12 +26,41 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import urllib
-import urllib2
-from datetime import datetime
+import base64
+import zlib
+import time
+import random
+import socket
+import httplib
+from urlparse import urlsplit
 import logging
 
+from pool import ConnectionPool, StaleConnection, IDEMPOTENT
+from breaker import CircuitBreaker
+from exceptions import TwitterTransportError
+from metrics import metrics
+import dates
+
 logger = logging.getLogger('twitter.http')
 
+# shared by every request made in this process
+pool = ConnectionPool()
+
+# fails requests fast while twitter is down; replace it with one that
+# has a store to carry the state over to the next run
+breaker = CircuitBreaker()
+
+# bytes read off the socket at a time
+CHUNK_SIZE = 16384
+
+# how many times a GET is repeated after a transport error or one of
+# RETRY_STATUSES, and the base and the cap of the exponential backoff
+# between the attempts, in seconds
+retries = 3
+backoff = 0.5
+max_backoff = 30
+RETRY_STATUSES = (500, 502, 503, 504)
+
 def debug(text):
     logger.debug(text)
 
@@ -40,34 +69,258 @@ def http_data(data):
     for k,v in data.iteritems():
         if v is not None:
             processed_data[k] = str(v)
-    str_data = urllib.urlencode(processed_data)
+    str_data = urllib.urlencode(sorted(processed_data.items()))
     return str_data
 
-def make_request(url, username='', password='', data={}, method='GET'):
+class Decompressor(object):
+    """
+    Decompresses a gzip or deflate encoded body one chunk at a time.
+    Deflate is supposed to be zlib-wrapped, but some servers send raw
+    deflate data, so that is tried when the zlib header doesn't parse.
+    """
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.started = False
+        if encoding == 'gzip':
+            self.zobj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.zobj = zlib.decompressobj()
+
+    def decompress(self, chunk):
+        if self.encoding == 'deflate' and not self.started:
+            self.started = True
+            try:
+                return self.zobj.decompress(chunk)
+            except zlib.error:
+                self.zobj = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self.zobj.decompress(chunk)
+
+    def flush(self):
+        return self.zobj.flush()
+
+def read_chunk(response):
+    """
+    Returns what arrived of the body of `response` so far, at most
+    CHUNK_SIZE bytes, or '' at its end. httplib's read(amt) waits for all
+    of `amt`, which would hold a streamed timeline back until the whole
+    body is in. Raises IncompleteRead if the connection closes before
+    Content-Length bytes arrived.
+    """
+    fp = response.fp
+    if response.chunked or response.length is None or fp is None or fp._rbuf.tell():
+        # chunked replies are read by httplib, which checks them itself
+        return response.read(CHUNK_SIZE)
+    if not response.length:
+        response.close()
+        return ''
+    chunk = fp._sock.recv(min(CHUNK_SIZE, response.length))
+    if not chunk:
+        raise httplib.IncompleteRead('', response.length)
+    response.length -= len(chunk)
+    if not response.length:
+        response.close()
+    return chunk
+
+def iter_body(response):
+    """
+    Yields the body of `response` as it arrives, decompressing it on the
+    fly if the server used gzip or deflate.
+    """
+    encoding = (response.getheader('content-encoding') or '').strip().lower()
+    decompressor = None
+    if encoding in ('gzip', 'x-gzip'):
+        decompressor = Decompressor('gzip')
+    elif encoding == 'deflate':
+        decompressor = Decompressor('deflate')
+    while True:
+        metrics.start('http.body')
+        try:
+            chunk = read_chunk(response)
+            received = len(chunk)
+            if chunk and decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+        finally:
+            metrics.stop()
+        if not received:
+            break
+        metrics.count('http.bytes_in', received)
+        if chunk:
+            yield chunk
+    if decompressor is not None:
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+def read_body(response):
+    return ''.join(iter_body(response))
+
+class ResponseBody(object):
+    """
+    Iterates over the decompressed chunks of a response body and gives
+    the connection back to the pool once the body is exhausted or the
+    iteration is abandoned.
+    """
+    def __init__(self, scheme, host, conn, response):
+        self.scheme = scheme
+        self.host = host
+        self.conn = conn
+        self.response = response
+        self.chunks = iter_body(response)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            return self.chunks.next()
+        except StopIteration:
+            self.close(True)
+            raise
+        except (socket.error, httplib.HTTPException), e:
+            self.close()
+            breaker.failure(self.host)
+            raise TwitterTransportError("%s: %s" % (self.host, str(e) or e.__class__.__name__))
+        except:
+            self.close()
+            raise
+
+    def close(self, complete=False):
+        if self.conn is not None:
+            reusable = complete and not self.response.will_close
+            pool.release(self.scheme, self.host, self.conn, reusable)
+            self.conn = None
+
+    def __del__(self):
+        self.close()
+
+def prepare_request(url, username='', password='', data={}, method='GET', headers={}):
+    """
+    Returns a tuple (scheme, host, path, body, headers) ready to be sent.
+    """
     str_data = http_data(data)
     if method == "GET":
         if str_data:
             url = "%s?%s" % (url, str_data)
     debug("%s %s" % (method, url))
+    request_headers = {'Connection': 'keep-alive',
+                       'Accept-Encoding': 'gzip, deflate'}
+    request_headers.update(headers)
     if username and password:
-        http_handler = urllib2.HTTPBasicAuthHandler()
-        http_handler.add_password(realm='Twitter API',
-                                  uri=url,
-                                  user=username,
-                                  passwd=password)
-    else:
-        http_handler = urllib2.HTTPHandler()
-    opener = urllib2.build_opener(http_handler)
-    try:
-        if method == 'GET':
-            f = opener.open(url)
+        # send credentials right away instead of waiting for a 401 challenge
+        credentials = base64.b64encode("%s:%s" % (username, password))
+        request_headers['Authorization'] = "Basic %s" % credentials
+    body = None
+    if method != 'GET':
+        body = str_data
+        request_headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    scheme, host, path, query, fragment = urlsplit(url)
+    if query:
+        path = "%s?%s" % (path, query)
+    metrics.count('http.requests')
+    # the request line and headers as sent, give or take the ones httplib adds
+    metrics.count('http.bytes_out', len(method) + len(path) + len(body or '') +
+                  sum(len(name) + len(value) + 4 for name, value in request_headers.iteritems()) + 13)
+    return scheme, host, path or '/', body, request_headers
+
+def send(method, host, attempt):
+    """
+    Calls `attempt()`, which makes a request to `host` and returns a
+    tuple (status, reason, headers, body), through the circuit breaker.
+    GETs failing with a transport error or with one of RETRY_STATUSES
+    are retried after a backoff with full jitter, or the delay the
+    server asked for with Retry-After; one that found its kept-alive
+    connection closed is retried right away, which also counts against
+    `retries` but not against the host.
+    Transport errors are raised as TwitterTransportError.
+    """
+    tries = 0
+    while True:
+        breaker.check(host)
+        result = error = None
+        stale = False
+        try:
+            result = attempt()
+        except StaleConnection, e:
+            stale = True
+            error = TwitterTransportError("%s: %s" % (host, e))
+        except (socket.error, httplib.HTTPException), e:
+            breaker.failure(host)
+            error = TwitterTransportError("%s: %s" % (host, str(e) or e.__class__.__name__))
         else:
-            f = opener.open(url, str_data)
-        retdata = f.read()
-        f.close()
-        return retdata
-    except urllib2.HTTPError, e:
-        return (e.code, e.msg)
+            if result[0] not in RETRY_STATUSES:
+                breaker.success(host)
+                return result
+            breaker.failure(host)
+        if method not in IDEMPOTENT or tries >= retries:
+            if error is not None:
+                raise error
+            return result
+        delay = 0
+        if not stale:
+            delay = random.uniform(0, min(max_backoff, backoff * 2 ** tries))
+        if result is not None:
+            retry_after = result[2].get('retry-after', '')
+            if retry_after.isdigit():
+                delay = min(max_backoff, int(retry_after))
+            if isinstance(result[3], ResponseBody):
+                result[3].close()
+        tries += 1
+        metrics.count('http.retries')
+        debug("retrying in %.1fs: %s" % (delay, error or "%s %s" % result[:2]))
+        metrics.start('http.backoff')
+        try:
+            time.sleep(delay)
+        finally:
+            metrics.stop()
+
+def request(url, username='', password='', data={}, method='GET', headers={}):
+    """
+    Performs a request, returns a tuple (status, reason, headers, body).
+    Response header names are lowercase.
+    """
+    scheme, host, path, body, request_headers = prepare_request(url, username, password, data, method, headers)
+    def attempt():
+        metrics.start('http.request')
+        try:
+            return pool.request(scheme, host, method, path, body, request_headers, read_body)
+        finally:
+            metrics.stop()
+    status, reason, response_headers, retdata = send(method, host, attempt)
+    debug("%s %s" % (status, reason))
+    return status, reason, response_headers, retdata
+
+def open_request(url, username='', password='', data={}, method='GET', headers={}):
+    """
+    Like request(), but returns as soon as the response headers arrived:
+    the body in the returned tuple (status, reason, headers, body) is a
+    generator of decompressed chunks read off the socket on demand.
+    The body must be consumed or closed for the connection to be reused.
+    Only getting the headers is retried; errors while reading the body
+    are raised as TwitterTransportError.
+    """
+    scheme, host, path, body, request_headers = prepare_request(url, username, password, data, method, headers)
+    def attempt():
+        metrics.start('http.request')
+        try:
+            conn, response = pool.open(scheme, host, method, path, body, request_headers)
+        finally:
+            metrics.stop()
+        return (response.status, response.reason,
+                dict(response.getheaders()),
+                ResponseBody(scheme, host, conn, response))
+    result = send(method, host, attempt)
+    debug("%s %s" % result[:2])
+    return result
+
+def make_request(url, username='', password='', data={}, method='GET'):
+    """
+    Returns the body of a successful response, or a tuple (status, reason)
+    if twitter answered with an error.
+    """
+    status, reason, headers, retdata = request(url, username, password, data, method)
+    if not 200 <= status < 300:
+        return (status, reason)
+    return retdata
 
 def GET(url, username='', password='', data={}):
     return make_request(url, username, password, data, 'GET')
@@ -76,7 +329,10 @@ def POST(url, username='', password='', data={}):
     return make_request(url, username, password, data, 'POST')
 
 def http_date(date):
-    # Tue%2C+27+Mar+2007+22%3A55%3A48+GMT
-    parsed_date = datetime.strptime(date, "%a %b %d %H:%M:%S +0000 %Y")
-    retval = datetime.strftime(parsed_date, "%b, %d %a %Y %H:%M:%S GMT")
-    return retval
+    """
+    Formats `date`, epoch seconds or a created_at timestamp, as an HTTP
+    date: Tue%2C+27+Mar+2007+22%3A55%3A48+GMT once urlencoded.
+    """
+    if isinstance(date, basestring):
+        date = dates.parse_created_at(date)
+    return dates.format_http_date(date)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+try:
+    from json import JSONDecoder
+except ImportError:
+    try:
+        from simplejson import JSONDecoder
+    except ImportError:
+        JSONDecoder = None
+
+WHITESPACE = ' \t\n\r'
+DELIMITERS = WHITESPACE + ',]'
+
+
+def iter_array(chunks, decode):
+    """
+    Incrementally decodes a JSON array that arrives as a sequence of
+    string chunks and yields its elements one by one, as soon as each of
+    them is complete.
+
+    `decode` is used to decode the whole document at once when the json
+    library in use can't decode a prefix of a string (cjson).
+    """
+    if JSONDecoder is None:
+        for item in decode(''.join(chunks)):
+            yield item
+        return
+    decoder = JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    exhausted = False
+    started = False
+    after_item = False
+    while True:
+        while pos < len(buf) and buf[pos] in WHITESPACE:
+            pos += 1
+        if pos == len(buf) or not started:
+            if pos == len(buf) and exhausted:
+                raise ValueError("Unexpected end of JSON array")
+            if pos < len(buf):
+                if buf[pos] != '[':
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+        else:
+            if buf[pos] == ']':
+                return
+            if buf[pos] == ',' and after_item:
+                after_item = False
+                pos += 1
+                continue
+            if after_item:
+                raise ValueError("Expected ',' or ']' in JSON array")
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if exhausted:
+                    raise
+            else:
+                # a number cut by the end of the buffer decodes fine, but
+                # might continue in the next chunk ("12" of "1234", "5" of
+                # "5.5"); it is only complete when followed by a delimiter
+                if exhausted or (end < len(buf) and buf[end] in DELIMITERS):
+                    yield item
+                    after_item = True
+                    pos = end
+                    continue
+        try:
+            chunk = chunks.next()
+        except StopIteration:
+            exhausted = True
+        else:
+            buf = buf[pos:] + chunk
+            pos = 0
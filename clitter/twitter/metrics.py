@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import time
+import threading
+
+
+class Metrics(object):
+    """
+    Collects how much time a run spends in each phase (reading the
+    config, HTTP, JSON decoding, the cache, rendering...) and counters
+    such as bytes received.
+
+    Phases nest: start() and stop() keep a stack per thread and the
+    time of a phase excludes the phases started inside it, so decoding
+    a streamed response doesn't count the time spent waiting for its
+    chunks. Totals are summed over all threads.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.phases = {}
+        self.counters = {}
+        self.started = time.time()
+
+    def __stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def start(self, phase):
+        now = time.time()
+        stack = self.__stack()
+        if stack:
+            # pause the enclosing phase
+            self.__add(stack[-1][0], now - stack[-1][1], 0)
+        stack.append([phase, now])
+
+    def stop(self):
+        now = time.time()
+        stack = self.__stack()
+        phase, since = stack.pop()
+        self.__add(phase, now - since, 1)
+        if stack:
+            stack[-1][1] = now
+
+    def __add(self, phase, seconds, calls):
+        self.lock.acquire()
+        try:
+            total = self.phases.get(phase, (0, 0.0))
+            self.phases[phase] = (total[0] + calls, total[1] + seconds)
+        finally:
+            self.lock.release()
+
+    def count(self, name, value=1):
+        self.lock.acquire()
+        try:
+            self.counters[name] = self.counters.get(name, 0) + value
+        finally:
+            self.lock.release()
+
+    def elapsed(self):
+        return time.time() - self.started
+
+
+# the metrics of this process
+metrics = Metrics()
+
+
+def timed(phase):
+    """
+    Decorates a function to run as `phase`.
+    """
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            metrics.start(phase)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.stop()
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+    return decorator
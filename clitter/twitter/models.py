@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import jsonlib
+import dates
+
+
+def project(data, fields, keep_extra):
+    """
+    Returns the fields of `data` outside of `fields` JSON-encoded, or
+    None if there are none or they aren't wanted.
+    """
+    if not keep_extra:
+        return None
+    rest = dict((k, v) for k, v in data.iteritems() if k not in fields)
+    if not rest:
+        return None
+    return jsonlib.dumps(rest)
+
+
+class Model(object):
+    """
+    Base for the compact models decoded API objects are projected onto.
+    Fields clitter doesn't use are dropped, or kept JSON-encoded in
+    `extra_blob` and decoded on first access to `extra`.
+    """
+    __slots__ = ('extra_blob', '_extra')
+    FIELDS = ()
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.FIELDS) + (self.extra_blob,)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.FIELDS, state):
+            setattr(self, name, value)
+        self.extra_blob = state[-1]
+        self._extra = None
+
+    @property
+    def extra(self):
+        if self._extra is None:
+            if self.extra_blob is None:
+                self._extra = {}
+            else:
+                self._extra = jsonlib.loads(self.extra_blob)
+        return self._extra
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.id)
+
+
+class User(Model):
+    __slots__ = ('id', 'screen_name', 'name')
+    FIELDS = __slots__
+
+    def __init__(self, id, screen_name=None, name=None, extra_blob=None):
+        self.id = id
+        self.screen_name = screen_name
+        self.name = name
+        self.extra_blob = extra_blob
+        self._extra = None
+
+    @classmethod
+    def from_json(cls, data, keep_extra=False):
+        return cls(data['id'], data.get('screen_name'), data.get('name'),
+                   project(data, cls.FIELDS, keep_extra))
+
+    def to_json(self):
+        data = dict(self.extra)
+        data.update(id=self.id, screen_name=self.screen_name, name=self.name)
+        return data
+
+
+class Status(Model):
+    """
+    A status; created_at is parsed into seconds since the epoch.
+    """
+    __slots__ = ('id', 'created_at', 'text', 'user')
+    FIELDS = __slots__
+
+    def __init__(self, id, created_at=None, text=None, user=None, extra_blob=None):
+        self.id = id
+        self.created_at = created_at
+        self.text = text
+        self.user = user
+        self.extra_blob = extra_blob
+        self._extra = None
+
+    @classmethod
+    def from_json(cls, data, keep_extra=False, users=None):
+        """
+        Projects a decoded status. `users` is an optional dict by id that
+        makes statuses by the same user share a single User.
+        """
+        user = None
+        if data.get('user'):
+            user_id = data['user']['id']
+            if users is not None and user_id in users:
+                user = users[user_id]
+            else:
+                user = User.from_json(data['user'], keep_extra)
+                if users is not None:
+                    users[user_id] = user
+        created_at = data.get('created_at')
+        if created_at is not None:
+            created_at = dates.parse_created_at(created_at)
+        return cls(data['id'], created_at, data.get('text'), user,
+                   project(data, cls.FIELDS, keep_extra))
+
+    def to_json(self):
+        """
+        Returns the status as a dict the API could have decoded it from,
+        minus the fields that were dropped.
+        """
+        data = dict(self.extra)
+        data.update(id=self.id, text=self.text)
+        if self.created_at is not None:
+            data['created_at'] = dates.format_created_at(self.created_at)
+        if self.user is not None:
+            data['user'] = self.user.to_json()
+        return data
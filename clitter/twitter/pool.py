@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import errno
+import httplib
+import socket
+import threading
+import time
+
+IDEMPOTENT = ('GET', 'HEAD')
+
+
+class StaleConnection(httplib.HTTPException):
+    """
+    A kept-alive connection turned out to be closed by the server; the
+    request never reached it and can be repeated on a fresh one.
+    """
+
+
+def is_stale(error, sent):
+    """
+    Tells whether `error` is how a keep-alive connection the server
+    closed meanwhile fails: reset or broken while the request is sent,
+    or closed without a status line. Timeouts never are.
+    """
+    if isinstance(error, socket.timeout):
+        return False
+    if isinstance(error, httplib.BadStatusLine):
+        return True
+    return not sent and isinstance(error, socket.error) and error.errno in (errno.ECONNRESET, errno.EPIPE)
+
+
+class ConnectionPool(object):
+    """
+    Keeps HTTP/1.1 connections open per host and hands them out again to
+    later requests, so that consecutive API calls within one process don't
+    pay for connect and handshake every time.
+
+    At most `max_per_host` connections (busy and idle together) are open
+    to one host; connections idle for longer than `idle_timeout` seconds
+    are closed instead of being reused. Connecting may take at most
+    `connect_timeout` seconds and every read off the socket at most
+    `read_timeout`; None waits forever.
+    """
+    def __init__(self, max_per_host=4, idle_timeout=30, connect_timeout=None, read_timeout=None):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.condition = threading.Condition()
+        self.idle = {}
+        self.busy = {}
+
+    def __new_connection(self, scheme, host):
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, timeout=self.connect_timeout)
+        return httplib.HTTPConnection(host, timeout=self.connect_timeout)
+
+    def acquire(self, scheme, host):
+        """
+        Returns a tuple (connection, reused).
+        Blocks while `max_per_host` connections to the host are busy.
+        """
+        key = (scheme, host)
+        self.condition.acquire()
+        try:
+            while True:
+                idle = self.idle.setdefault(key, [])
+                now = time.time()
+                while idle:
+                    conn, released_at = idle.pop()
+                    if now - released_at < self.idle_timeout:
+                        self.busy[key] = self.busy.get(key, 0) + 1
+                        return conn, True
+                    conn.close()
+                if self.busy.get(key, 0) < self.max_per_host:
+                    self.busy[key] = self.busy.get(key, 0) + 1
+                    break
+                self.condition.wait()
+        finally:
+            self.condition.release()
+        return self.__new_connection(scheme, host), False
+
+    def release(self, scheme, host, conn, reusable=True):
+        key = (scheme, host)
+        self.condition.acquire()
+        try:
+            self.busy[key] -= 1
+            if reusable:
+                self.idle.setdefault(key, []).append((conn, time.time()))
+            else:
+                conn.close()
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def open(self, scheme, host, method, path, body=None, headers={}):
+        """
+        Sends a request and waits for the status line and headers.
+        Returns a tuple (connection, response); the connection stays
+        checked out until it is given back with release().
+        A GET or HEAD failing on a connection the server closed while it
+        was idle raises StaleConnection, so that the caller can count
+        repeating it as an attempt.
+        """
+        conn, reused = self.acquire(scheme, host)
+        sent = False
+        try:
+            if conn.sock is None:
+                conn.connect()
+                conn.sock.settimeout(self.read_timeout)
+            conn.request(method, path, body, headers)
+            sent = True
+            response = conn.getresponse()
+        except (httplib.HTTPException, socket.error), e:
+            self.release(scheme, host, conn, False)
+            if reused and method in IDEMPOTENT and is_stale(e, sent):
+                raise StaleConnection(str(e) or e.__class__.__name__)
+            raise
+        except:
+            self.release(scheme, host, conn, False)
+            raise
+        return conn, response
+
+    def request(self, scheme, host, method, path, body=None, headers={}, read=None):
+        """
+        Performs a request and reads the whole response, either with
+        `read(response)` or plainly.
+        Returns a tuple (status, reason, headers, body).
+        """
+        conn, response = self.open(scheme, host, method, path, body, headers)
+        try:
+            if read is None:
+                retdata = response.read()
+            else:
+                retdata = read(response)
+        except:
+            self.release(scheme, host, conn, False)
+            raise
+        self.release(scheme, host, conn, not response.will_close)
+        return (response.status, response.reason,
+                dict(response.getheaders()), retdata)
+
+    def close(self):
+        self.condition.acquire()
+        try:
+            for idle in self.idle.itervalues():
+                for conn, released_at in idle:
+                    conn.close()
+            self.idle = {}
+        finally:
+            self.condition.release()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008, Konstantin Merenkov <kmerenkov@gmail.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY Konstantin Merenkov <kmerenkov@gmail.com> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL Konstantin Merenkov <kmerenkov@gmail.com> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import time
+import threading
+
+from exceptions import RateLimitExceeded
+from metrics import metrics
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class RateLimiter(object):
+    """
+    Meters API calls against the hourly budget of an account, as told by
+    rate_limit_status and the X-RateLimit-* headers. Interactive calls
+    only count against the remaining hits. Background calls leave
+    `reserve` of the limit to them and are paced by a token bucket of
+    `burst` tokens, refilled at what is left of their share spread until
+    the reset; after `max_wait` seconds without a token they give up
+    with RateLimitExceeded. save() keeps the budget in `store` for the
+    next run.
+    """
+    def __init__(self, username, store=None, reserve=0.2, burst=10, max_wait=30):
+        self.key = "ratelimit %s" % username
+        self.store = store
+        self.reserve = reserve
+        self.burst = burst
+        self.max_wait = max_wait
+        self.condition = threading.Condition()
+        self.hourly_limit = 150
+        self.remaining = None
+        self.reset_time = None
+        self.tokens = float(burst)
+        self.stamp = time.time()
+        if store is not None:
+            state = store.get(self.key)
+            if state:
+                (self.hourly_limit, self.remaining, self.reset_time,
+                 self.tokens, self.stamp) = state
+
+    def save(self):
+        if self.store is not None:
+            self.condition.acquire()
+            try:
+                state = (self.hourly_limit, self.remaining, self.reset_time,
+                         self.tokens, self.stamp)
+            finally:
+                self.condition.release()
+            self.store.set(self.key, state)
+
+    def __refill(self):
+        now = time.time()
+        if self.reset_time is not None and now >= self.reset_time:
+            self.remaining = self.hourly_limit
+            self.reset_time += 60 * 60 * (1 + int((now - self.reset_time) / (60 * 60)))
+        if self.remaining is not None and self.reset_time is not None and self.reset_time > now:
+            share = self.remaining - self.reserve * self.hourly_limit
+            rate = max(0, share) / (self.reset_time - now)
+        else:
+            rate = max(1, self.hourly_limit) / (60.0 * 60.0)
+        # never quite stop, a reset or an update brings the rate back
+        rate = max(rate, 1 / (60.0 * 60.0))
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * rate)
+        self.stamp = now
+        return rate
+
+    def update(self, hourly_limit=None, remaining=None, reset_time=None):
+        self.condition.acquire()
+        try:
+            self.__refill()
+            if hourly_limit is not None:
+                self.hourly_limit = int(hourly_limit)
+            if remaining is not None:
+                self.remaining = int(remaining)
+            if reset_time is not None:
+                self.reset_time = float(reset_time)
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def update_from_headers(self, headers):
+        self.update(headers.get('x-ratelimit-limit'),
+                    headers.get('x-ratelimit-remaining'),
+                    headers.get('x-ratelimit-reset'))
+
+    def available(self, priority=INTERACTIVE):
+        """
+        Returns how many calls of `priority` the budget allows right now,
+        or None if the budget is not known yet.
+        """
+        self.condition.acquire()
+        try:
+            self.__refill()
+            if self.remaining is None:
+                return None
+            if priority == INTERACTIVE:
+                return max(0, self.remaining)
+            return max(0, int(self.remaining - self.reserve * self.hourly_limit))
+        finally:
+            self.condition.release()
+
+    def ready(self):
+        """
+        Returns how many background calls can be made without waiting.
+        """
+        self.condition.acquire()
+        try:
+            self.__refill()
+            return int(self.tokens)
+        finally:
+            self.condition.release()
+
+    def __resets_in(self):
+        if self.reset_time is None:
+            return "later"
+        return "in %d minutes" % max(1, int((self.reset_time - time.time()) / 60))
+
+    def acquire(self, priority=INTERACTIVE, max_wait=None):
+        """
+        Takes one call out of the budget, waiting for it if `priority` is
+        BACKGROUND, at most `max_wait` seconds if given. Raises
+        RateLimitExceeded when the call can't be made.
+        """
+        self.condition.acquire()
+        try:
+            if priority == INTERACTIVE:
+                self.__refill()
+                if self.remaining is not None and self.remaining <= 0:
+                    raise RateLimitExceeded("Rate limit exceeded, resets %s" % self.__resets_in())
+                self.__count()
+                return
+            if max_wait is None:
+                max_wait = self.max_wait
+            deadline = time.time() + max_wait
+            while True:
+                rate = self.__refill()
+                floor = self.reserve * self.hourly_limit
+                if self.remaining is not None and self.remaining <= floor:
+                    raise RateLimitExceeded("Rate limit reserved for interactive use, resets %s" % self.__resets_in())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.__count()
+                    return
+                delay = max(0.1, (1 - self.tokens) / rate)
+                if time.time() + delay > deadline:
+                    raise RateLimitExceeded("Background requests are paced, try again later")
+                metrics.start('rate.wait')
+                try:
+                    self.condition.wait(delay)
+                finally:
+                    metrics.stop()
+        finally:
+            self.condition.release()
+
+    def __count(self):
+        if self.remaining is not None:
+            self.remaining -= 1